@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+""" run a parameter grid on workers spread over several hosts
+
+usage: coordinator.py [-k <authkey>] serve [-b <host>] [-p <port>] [-s <grid spec>] [-c <runs per chunk>] [-o <result-db> [-t]] <har-file> [...]
+       coordinator.py [-k <authkey>] work [-j <processes>] <host>:<port>
+
+the coordinator splits the grid of sweep.py into chunks of runs and hands them out over tcp
+to whichever worker asks next, so fast hosts simply take more chunks. workers read the .har
+files themselves (shared file system) - the coordinator checks that they see the same pages.
+
+chunks of workers that disconnect are handed out again right away, chunks of workers that
+hang are handed out again when their lease expires. when no chunk is left, idle workers take
+a second copy of the oldest outstanding chunk - the first result of a chunk is used. chunks
+that fail on several workers are given up (and logged). the aggregate throughput is logged
+while the grid runs.
+
+results are printed like sweep.py does, or written to a result store with -o - runs that are
+already in the store are not handed out.
+
+coordinator and workers exchange pickled messages (multiprocessing.connection), so anyone who
+knows the authkey can run code on the other side - in the coordinator as a worker, in workers
+as a coordinator. there is no default authkey: it has to be given with -k or in the environment
+(DTSIMULATOR_AUTHKEY), and only hosts that are trusted with it must be able to reach the port.
+the coordinator listens on localhost unless another address is given with -b.
+"""
+
+import sys, os
+import json
+import time
+import socket
+import threading
+import queue
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+from simulator.transferManager import TransferManager
+from simulator.eventSimulator import setupLogging
+from workload import readPage, workloadHash
+from results import storedKeys
+from sweep import DEFAULT_SPEC, gridPoints, runKey, runPoint, writeResults
+
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+logger = logging.getLogger("coordinator")
+
+PORT = 7743
+# environment variable holding the shared secret of coordinator and workers
+AUTHKEY_ENV = 'DTSIMULATOR_AUTHKEY'
+# runs per chunk
+CHUNK_RUNS = 16
+# seconds a worker may take for a chunk before it is handed out again
+LEASE_TIME = 600.0
+# workers a chunk may fail on before it is given up
+MAX_ATTEMPTS = 3
+# seconds between throughput reports
+REPORT_INTERVAL = 30.0
+# seconds to wait for busy workers to ask for more when the grid is done
+LINGER_TIME = 5.0
+
+
+class Coordinator(object):
+    """ hands out the grid in chunks to workers connecting to address with authkey
+
+    run() yields (page index, run summary) in the order chunks are finished - every run has its 'key'
+    """
+
+    def __init__(self, harFileNames, spec, authkey, address=('localhost', PORT), chunkRuns=CHUNK_RUNS,
+                 leaseTime=LEASE_TIME, transfers=False, done=None):
+        if not authkey:
+            raise ValueError("the coordinator needs an authkey")
+        self.harFileNames = harFileNames
+        self.spec = spec
+        self.leaseTime = leaseTime
+        self.transfers = transfers
+
+        self.origins = []
+        self.pageHashes = []
+        for ifileName in harFileNames:
+            transferManager = TransferManager()
+            self.origins.append(readPage(ifileName, transferManager))
+            self.pageHashes.append(workloadHash(transferManager))
+
+        # runs are (page, grid index, key) - workers look up the grid points themselves
+        work = []
+        for (page, pageHash) in enumerate(self.pageHashes):
+            for (n, point) in enumerate(gridPoints(spec)):
+                key = runKey(pageHash, point)
+                if not done or key not in done:
+                    work.append((page, n, key))
+        self.runs = len(work)
+        self.chunks = [work[n:n + chunkRuns] for n in range(0, len(work), chunkRuns)]
+
+        self.lock = threading.Condition()
+        self.pending = deque(range(len(self.chunks)))
+        # chunk -> [(worker, lease time)] of unfinished chunks
+        self.leases = {}
+        self.attempts = {}
+        self.closed = set()
+        self.failed = []
+        self.duplicates = 0
+        # worker -> runs done
+        self.workers = {}
+        self.stopping = False
+        self.results = queue.Queue()
+        self.handlers = []
+
+        # workers of a host all connect at once
+        self.listener = Listener(address, backlog=64, authkey=authkey)
+        self.address = self.listener.address
+
+
+    def run(self):
+        acceptor = threading.Thread(target=self._accept, name="Coordinator", daemon=True)
+        acceptor.start()
+
+        started = time.monotonic()
+        lastReport = started
+        done = 0
+        try:
+            for _ in range(len(self.chunks)):
+                runs = None
+                while runs is None:
+                    try:
+                        runs = self.results.get(timeout=REPORT_INTERVAL)
+                    except queue.Empty:
+                        pass
+                    if time.monotonic() - lastReport >= REPORT_INTERVAL:
+                        lastReport = time.monotonic()
+                        self._report(done, lastReport - started)
+                done += len(runs)
+                yield from runs
+        finally:
+            self._stop()
+
+        self._report(done, time.monotonic() - started)
+        for (worker, runs) in sorted(self.workers.items()):
+            logger.info("{w}: {r} runs".format(w=worker, r=runs))
+        if self.failed:
+            logger.error("{c} chunks failed ({r} runs) - see the errors above".format(c=len(self.failed), r=sum(len(self.chunks[c]) for c in self.failed)))
+
+
+    def _report(self, done, elapsed):
+        with self.lock:
+            leased = sum(len(leases) for leases in self.leases.values())
+        logger.info("{d}/{t} runs in {e:.0f}s - {r:.2f} runs/s, {l} chunks leased, {u} duplicate results".format(
+            d=done, t=self.runs, e=elapsed, r=done / elapsed if elapsed else 0.0, l=leased, u=self.duplicates))
+
+
+    def _stop(self):
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+        self.listener.close()
+        # wake up the acceptor - closing the listener does not
+        try:
+            socket.create_connection(self.address, timeout=1.0).close()
+        except OSError:
+            pass
+        # tell the workers to stop instead of leaving them with a closed connection
+        deadline = time.monotonic() + LINGER_TIME
+        for handler in list(self.handlers):
+            handler.join(max(0.0, deadline - time.monotonic()))
+
+
+    def _accept(self):
+        while not self.stopping:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                if not self.stopping:
+                    logger.warning("rejected a connection: {e!r}".format(e=e))
+                continue
+            handler = threading.Thread(target=self._serve, args=(conn,), daemon=True)
+            handler.start()
+            self.handlers.append(handler)
+
+
+    def _serve(self, conn):
+        worker = None
+        leased = set()
+        try:
+            (_, worker) = conn.recv()
+            logger.info("worker {w} connected".format(w=worker))
+            conn.send(('setup', self.harFileNames, self.spec, self.pageHashes, self.transfers))
+            while True:
+                message = conn.recv()
+                if message[0] == 'get':
+                    chunk = self._lease(worker)
+                    if chunk is None:
+                        conn.send(('stop',))
+                        break
+                    leased.add(chunk)
+                    conn.send(('chunk', chunk, self.chunks[chunk]))
+                elif message[0] == 'result':
+                    (_, chunk, runs) = message
+                    leased.discard(chunk)
+                    self._finish(worker, chunk, runs)
+                elif message[0] == 'failed':
+                    (_, chunk, error) = message
+                    leased.discard(chunk)
+                    self._fail(worker, chunk, error)
+
+        except (OSError, EOFError) as e:
+            logger.warning("lost worker {w}: {e!r}".format(w=worker, e=e))
+        finally:
+            self._release(worker, leased)
+            conn.close()
+
+
+    def _lease(self, worker):
+        """ next chunk for worker - None when the grid is done """
+        with self.lock:
+            while not self.stopping and len(self.closed) < len(self.chunks):
+                chunk = self.pending.popleft() if self.pending else self._steal()
+                if chunk is not None:
+                    self.leases.setdefault(chunk, []).append((worker, time.monotonic()))
+                    return chunk
+                self.lock.wait(1.0)
+            return None
+
+
+    def _steal(self):
+        # expired chunks first, then chunks only one worker has - oldest lease first
+        now = time.monotonic()
+        candidates = []
+        for (chunk, leases) in self.leases.items():
+            oldest = min(t for (_, t) in leases)
+            expired = all(now - t > self.leaseTime for (_, t) in leases)
+            if expired or len(leases) < 2:
+                candidates.append((not expired, len(leases), oldest, chunk))
+        return min(candidates)[-1] if candidates else None
+
+
+    def _unlease(self, worker, chunk):
+        if chunk in self.closed:
+            return
+        leases = [(w, t) for (w, t) in self.leases.get(chunk, []) if w != worker]
+        if leases:
+            self.leases[chunk] = leases
+        else:
+            self.leases.pop(chunk, None)
+
+
+    def _finish(self, worker, chunk, runs):
+        with self.lock:
+            if chunk in self.closed:
+                self.duplicates += 1
+                return
+            self.closed.add(chunk)
+            self.leases.pop(chunk, None)
+            self.workers[worker] = self.workers.get(worker, 0) + len(runs)
+            self.lock.notify_all()
+        self.results.put(runs)
+
+
+    def _fail(self, worker, chunk, error):
+        logger.error("chunk {c} failed on worker {w}: {e}".format(c=chunk, w=worker, e=error))
+        with self.lock:
+            if chunk in self.closed:
+                return
+            self._unlease(worker, chunk)
+            self.attempts[chunk] = self.attempts.get(chunk, 0) + 1
+            if self.attempts[chunk] >= MAX_ATTEMPTS:
+                self.closed.add(chunk)
+                self.leases.pop(chunk, None)
+                self.failed.append(chunk)
+                self.results.put([])
+            elif chunk not in self.leases:
+                self.pending.append(chunk)
+            self.lock.notify_all()
+
+
+    def _release(self, worker, leased):
+        # chunks of a lost worker go back to the front of the queue
+        with self.lock:
+            for chunk in leased:
+                self._unlease(worker, chunk)
+                if chunk not in self.closed and chunk not in self.leases:
+                    self.pending.appendleft(chunk)
+            self.lock.notify_all()
+
+
+
+def work(address, authkey):
+    """ run chunks of the coordinator at address until the grid is done - returns the number of runs """
+    if not authkey:
+        raise ValueError("workers need an authkey")
+    worker = "{host}:{pid}".format(host=socket.gethostname(), pid=os.getpid())
+    conn = Client(address, authkey=authkey)
+    runs = 0
+    try:
+        conn.send(('hello', worker))
+        (_, harFileNames, spec, pageHashes, transfers) = conn.recv()
+
+        pages = []
+        for ifileName in harFileNames:
+            transferManager = TransferManager()
+            readPage(ifileName, transferManager)
+            pages.append(transferManager)
+        if [workloadHash(p) for p in pages] != pageHashes:
+            raise ValueError("the pages differ from the ones of the coordinator - is the workload on a shared file system?")
+        points = list(gridPoints(spec))
+
+        while True:
+            conn.send(('get',))
+            message = conn.recv()
+            if message[0] == 'stop':
+                return runs
+
+            (_, chunk, items) = message
+            try:
+                results = []
+                for (page, n, key) in items:
+                    run = runPoint(pages[page], points[n], transfers)
+                    run['key'] = key
+                    results.append((page, run))
+            except Exception as e:
+                logger.exception("chunk {c} failed".format(c=chunk))
+                conn.send(('failed', chunk, repr(e)))
+                continue
+            conn.send(('result', chunk, results))
+            runs += len(results)
+
+    except (OSError, EOFError) as e:
+        # a coordinator that is done does not wait for workers busy with a second copy of a chunk
+        logger.warning("lost the coordinator after {r} runs: {e!r}".format(r=runs, e=e))
+        return runs
+    finally:
+        conn.close()
+
+
+def _parseAddress(address):
+    (host, _, port) = address.rpartition(':')
+    return (host or 'localhost', int(port))
+
+
+if __name__ == "__main__":
+    setupLogging(fast=True)
+
+    parser = argparse.ArgumentParser(description="run a parameter grid on workers spread over several hosts")
+    parser.add_argument('-k', '--authkey', default=os.environ.get(AUTHKEY_ENV),
+                        help="shared secret of coordinator and workers - defaults to ${env}".format(env=AUTHKEY_ENV))
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help="hand out the grid to workers")
+    serve.add_argument('-b', '--bind', default='localhost', metavar='HOST', help="address to listen on - defaults to localhost")
+    serve.add_argument('-p', '--port', type=int, default=PORT)
+    serve.add_argument('-s', '--spec', help="grid spec (json) - defaults to the grid of generateTasks.py")
+    serve.add_argument('-c', '--chunk', type=int, default=CHUNK_RUNS, help="runs per chunk")
+    serve.add_argument('-o', '--output', help="result store (sqlite) to write the runs to instead of printing them")
+    serve.add_argument('-t', '--transfers', action='store_true', help="write the times of every transfer to the result store")
+    serve.add_argument('harFiles', nargs='+', metavar='har-file')
+    worker = commands.add_parser('work', help="run chunks of a coordinator")
+    worker.add_argument('-j', '--processes', type=int, default=1, help="number of worker processes - 0 uses all cores")
+    worker.add_argument('address', metavar='host:port')
+    args = parser.parse_args()
+    if args.command and not args.authkey:
+        parser.error("an authkey is needed (-k or ${env}) - messages are unpickled, so keep it secret".format(env=AUTHKEY_ENV))
+    authkey = args.authkey.encode() if args.authkey else None
+
+    if args.command == 'work':
+        address = _parseAddress(args.address)
+        processes = [multiprocessing.Process(target=work, args=(address, authkey)) for _ in range(args.processes or os.cpu_count())]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        sys.exit(1 if any(p.exitcode != 0 for p in processes) else 0)
+
+    elif args.command == 'serve':
+        if args.transfers and not args.output:
+            parser.error("-t needs a result store (-o)")
+        spec = DEFAULT_SPEC
+        if args.spec:
+            with open(args.spec) as fh:
+                spec = json.load(fh)
+
+        coordinator = Coordinator(args.harFiles, spec, authkey, (args.bind, args.port), args.chunk, transfers=args.transfers,
+                                  done=storedKeys(args.output, args.transfers) if args.output else None)
+        pageInfo = [(origin,) + tuple(os.path.basename(f)[:-4].split('+')[1:]) for (origin, f) in zip(coordinator.origins, args.harFiles)]
+        logger.info("{r} runs in {c} chunks - waiting for workers on {h}:{p}".format(r=coordinator.runs, c=len(coordinator.chunks), h=args.bind, p=args.port))
+        writeResults(coordinator.run(), pageInfo, args.output)
+        sys.exit(1 if coordinator.failed else 0)
+
+    else:
+        parser.print_help()
+        sys.exit(-1)
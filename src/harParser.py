@@ -1,9 +1,11 @@
 """ Parse .har files and generate transfers objects for the data transfer simulator """
 
 import json
+import re
 import sys
 import datetime
 import logging
+from operator import attrgetter
 from simulator.transfer import Transfer
 
 
@@ -14,12 +16,131 @@ __license__ = "RELAXED CRAPL v0 BETA 1"
 
 logger = logging.getLogger("harParser")
 
+# characters read from a .har file at once
+CHUNK_SIZE = 1 << 16
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+# characters that may follow a value
+DELIMITERS = ',:]}'
+
+
+class JsonStream(object):
+	""" reads the members of a large json document one value at a time
+
+	only the value currently decoded and the unread rest of a chunk are kept in memory
+	"""
+	def __init__(self, fh, chunkSize=CHUNK_SIZE):
+		self.fh = fh
+		self.chunkSize = chunkSize
+		self.buffer = ""
+		self.pos = 0
+
+
+	def _fill(self, size):
+		data = self.fh.read(size)
+		if not data:
+			return False
+		self.buffer = self.buffer[self.pos:] + data
+		self.pos = 0
+		return True
+
+
+	def peek(self):
+		""" next character that is not whitespace - empty at the end of the document """
+		while True:
+			self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+			if not self._fill(self.chunkSize):
+				return ""
+
+
+	def expect(self, chars):
+		c = self.peek()
+		if not c or c not in chars:
+			raise ValueError("unexpected {c!r} in json document - expected one of {chars!r}".format(c=c, chars=chars))
+		self.pos += 1
+		return c
+
+
+	# true if a delimiter follows position end in the buffer - values end before one
+	def _delimited(self, end):
+		end = WHITESPACE.match(self.buffer, end).end()
+		return end < len(self.buffer) and self.buffer[end] in DELIMITERS
+
+
+	def value(self):
+		""" decode the next value """
+		self.peek()
+		while True:
+			try:
+				(value, end) = DECODER.raw_decode(self.buffer, self.pos)
+				error = None
+			except json.JSONDecodeError as e:
+				(value, end, error) = (None, None, e)
+
+			# incomplete values and values not followed by a delimiter might continue in the next chunk -
+			# numbers decode up to a chunk boundary after their '.', 'e' or 'e-' as well.
+			# the buffer at least doubles, so large values are decoded only a few times
+			if (end is None or not self._delimited(end)) and self._fill(max(self.chunkSize, len(self.buffer) - self.pos)):
+				continue
+			if error:
+				raise error
+			self.pos = end
+			return value
+
+
+	def find(self, *keys):
+		""" skip to the value of nested object members - raises KeyError if a member is missing """
+		for key in keys:
+			self.expect('{')
+			if self.peek() == '}':
+				raise KeyError(key)
+			while True:
+				name = self.value()
+				self.expect(':')
+				if name == key:
+					break
+				self.value()
+				if self.expect(',}') == '}':
+					raise KeyError(key)
+
+
+	def items(self):
+		""" yield the elements of the array at the current position """
+		self.expect('[')
+		if self.peek() == ']':
+			self.pos += 1
+			return
+		while True:
+			yield self.value()
+			if self.expect(',]') == ']':
+				return
+
+
+def parseTimestamp(timestamp):
+	""" parse the startedDateTime of an entry - the utc offset (last 6 characters) is ignored """
+	try:
+		return datetime.datetime.fromisoformat(timestamp[:-6])
+	except ValueError:
+		# fromisoformat is faster by far but stricter on older pythons
+		return datetime.datetime.strptime(timestamp[:-6], "%Y-%m-%dT%H:%M:%S.%f")
+
+
+def iterEntries(fh, chunkSize=CHUNK_SIZE):
+	""" yield the entries of a .har file one at a time """
+	stream = JsonStream(fh, chunkSize)
+	stream.find('log', 'entries')
+	yield from stream.items()
+
+
 class HarParser(object):
 	def __init__(self, fh, transferManager, verification=False):
 		self.transferManager = transferManager
 		self.verification = verification
-		self.harData = json.load(fh)
-		self.harWebObjects = self.harData['log']['entries']
+		# entries are streamed by generateTransfers - fh has to stay open until then
+		self.harWebObjects = iterEntries(fh)
 		self.origin = None
 
 
@@ -42,8 +163,7 @@ class HarParser(object):
 	def generateTransfer(self, harStartTimeObj, webObject):
 
 		# all relative times in ms, but python parses daytime objects 
-		startTimeStr = webObject['startedDateTime']
-		startTimeObj = datetime.datetime.strptime(startTimeStr[:-6], "%Y-%m-%dT%H:%M:%S.%f")
+		startTimeObj = parseTimestamp(webObject['startedDateTime'])
 		startTime    = (startTimeObj - harStartTimeObj).total_seconds() * 1000
 		assert startTime >= 0
 
@@ -89,11 +209,16 @@ class HarParser(object):
 
 	def generateTransfers(self):
 
-		harStartTimeStr = self.harWebObjects[0]['startedDateTime']
-		harStartTimeObj = datetime.datetime.strptime(harStartTimeStr[:-6], "%Y-%m-%dT%H:%M:%S.%f")
-
-		# read all transfers
-		transfers = sorted(filter(lambda t: t, map(lambda o: self.generateTransfer(harStartTimeObj, o), self.harWebObjects)), key=lambda t: t.harStartTime)
+		# read all transfers - every entry is dropped as soon as its transfer is generated
+		harStartTimeObj = None
+		transfers = []
+		for webObject in self.harWebObjects:
+			if harStartTimeObj is None:
+				harStartTimeObj = parseTimestamp(webObject['startedDateTime'])
+			transfer = self.generateTransfer(harStartTimeObj, webObject)
+			if transfer:
+				transfers.append(transfer)
+		transfers.sort(key=attrgetter('harStartTime'))
 
 		# parse url and 
 		self.origin = transfers[0].origin
@@ -102,25 +227,22 @@ class HarParser(object):
 		self.transferManager.addTransfer(transfers[0])
 		self.transferManager.enableTransfer(transfers[0])
 		
-		# add transfers and generate dependencies
-		finishingTransfers = sorted(transfers, key=lambda t: t.harFinishTime)
-		lastDependency = None
-		nextDependency = finishingTransfers.pop(0)
+		# add transfers and generate dependencies - every transfer depends on the transfer that finished last before it started.
+		# transfers are visited in start order while an index walks the finish order, so the whole pass is linear after sorting
+		finishingTransfers = sorted(transfers, key=attrgetter('harFinishTime'))
+		finished = 0
 		for transfer in transfers[1:]:
 
 			self.transferManager.addTransfer(transfer)
 
-			# can we move dependency chain forward?
-			while nextDependency and nextDependency.harFinishTime < transfer.harStartTime:
-				lastDependency = nextDependency
-				nextDependency = finishingTransfers.pop(0)
-
-			assert not nextDependency or nextDependency.harFinishTime >= transfer.harStartTime
+			# can we move dependency chain forward? - transfers finish after they start, so this stops at transfer itself
+			while finishingTransfers[finished].harFinishTime < transfer.harStartTime:
+				finished += 1
 
 			# no one has finished yet
-			if lastDependency == None:
+			if finished == 0:
 				logger.warning("harfile has multiple first transfers - index file missing?")
 				self.transferManager.enableTransfer(transfer)
 			else:
-				#logger.debug("adding child: {0} to transfer: {1}".format(transfer.getInfo(), lastDependency.getInfo()))
-				lastDependency.addChild(transfer)
+				#logger.debug("adding child: {0} to transfer: {1}".format(transfer.getInfo(), finishingTransfers[finished - 1].getInfo()))
+				finishingTransfers[finished - 1].addChild(transfer)
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 """ run a simulation using in the data transfer simulator 
 
-usage: mainSingle.py (m|k} <bw1> <rtt1> (m|k} <bw2> <rtt2> <policy> <har-file> <json output>
+usage: mainSingle.py [--compact] (m|k} <bw1> <rtt1> (m|k} <bw2> <rtt2> <policy> <har-file> <json output>
 
-the simulation result is printed to sys.stdout, log and errors are printed to sys.stderr
+the simulation result is printed to sys.stdout, log and errors are printed to sys.stderr.
+json output files ending in .gz are compressed, --compact writes them without whitespace
+and with short keys (see TransferManager.dumpJson)
 """
 
 import sys, os
+import gzip
 import logging
 from itertools import chain
 
@@ -14,7 +17,8 @@ from simulator.globals import *
 from simulator.transferManager import *
 from simulator.interface import Interface
 from simulator.policy import *
-from harParser import HarParser
+from simulator.eventSimulator import setupLogging
+from workload import readPage
 
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
@@ -24,8 +28,15 @@ __license__ = "RELAXED CRAPL v0 BETA 1"
 
 logger = logging.getLogger("main")
 logging.disable(logging.DEBUG)
+setupLogging(fast=True)
 
-def simulatorRun(ifileName, origin, transferManager, policy, interfaces, oFile):
+def openOutput(fileName):
+    if fileName.endswith(".gz"):
+        return gzip.open(fileName, 'wt', compresslevel=6)
+    return open(fileName, 'w')
+
+
+def simulatorRun(ifileName, origin, transferManager, policy, interfaces, oFile, compact=False):
 
     (infileSite, infileDate, infileTime) = ifileName[:-4].split('+')
 
@@ -36,17 +47,22 @@ def simulatorRun(ifileName, origin, transferManager, policy, interfaces, oFile):
         print('{h:<16s}{i}'.format(h=h, i=i.getInfo()), file=progressFH)
         h = ""
     (result, time) = transferManager.runTransfers(interfaces, policy)
-    print('\n{h:<16s}{t:3.3f}s\n\n'.format(h="result:", t=time), end="", file=progressFH, flush=True)
+    print('\n{h:<16s}{t:3.3f}s'.format(h="result:", t=time), file=progressFH)
+    print('{h:<16s}{shared} shared / {simulated} simulated ({cutoffs} cut off) / {analytic} analytic\n\n'.format(h="predictions:", cutoffs=result.predictionCutoffs, analytic=result.getAnalyticPredictionStats()['predictions'], **result.getPredictionStats()), end="", file=progressFH, flush=True)
 
     # print simple output to stdout
     #"website", "crawl", "time", "policy", "if1_bw", "if1_rtt", "if2_bw", "if2_rtt", "time"
     print( ",".join(map(lambda s: str(s), [origin, infileDate, infileTime, policy.getInfo()] + list(chain.from_iterable( map(lambda i: [i.bandwidth, i.rtt], interfaces))) + [time])))
 
     # dump simulator as json object
-    result.dumpJson(oFile)
+    result.dumpJson(oFile, compact)
 
 
 if __name__ == "__main__":
+    compact = '--compact' in sys.argv
+    if compact:
+        sys.argv.remove('--compact')
+
     bw1 = None
     if sys.argv[1] == 'm':
         bw1 = mbit(float(sys.argv[2]))
@@ -67,17 +83,14 @@ if __name__ == "__main__":
 
     ifileName = sys.argv[8]
     if sys.argv[9]:
-        oFile = open(sys.argv[9], 'w')
+        oFile = openOutput(sys.argv[9])
     else:
         oFilePrefix = os.path.basename(ifileName[:-4]+".result")
-        oFile = open("{pfx}.sim.json".format(pfx=oFilePrefix), 'w')
+        oFile = openOutput("{pfx}.sim.json".format(pfx=oFilePrefix))
 
 
     transferManager = TransferManager()
-    fh = open(ifileName)
-    h = HarParser(fh, transferManager)
-    h.generateTransfers()
-    fh.close()
+    origin = readPage(ifileName, transferManager)
 
     oFile.write('{"simulatorResults": [\n')
 
@@ -85,18 +98,10 @@ if __name__ == "__main__":
     interfaces = [Interface(rtt=rtt1, bandwidth=bw1, description="if1"),
                   Interface(rtt=rtt2, bandwidth=bw2, description="if2")]
 
-    policies = {"only1-1": useOneInterfaceOnly(interfaces[0]), 
-                "only1-2": useOneInterfaceOnly(interfaces[1]), 
-                "rr-1": roundRobin(interfaces), 
-                "rr-2": roundRobin([interfaces[1], interfaces[0]]), 
-                "eaf": earliestArrivalFirst(),
-                "mptcp": mptcpFullMeshPolicy(),
-                "mptcp-1": mptcpFullMeshIFListPolicy(interfaces),
-                "eaf-mptcp": earliestArrivalFirstMPTCP()}
+    policy = createPolicy(policyStr, interfaces)
 
     #print("simulatorRun({ifileName}, {origin}, -, {policy}, {interfaces}, {oFilePrefix})".format(ifileName=ifileName, origin=h.origin, policy=policy.getInfo(), interfaces=[i.getInfo() for i in interfaces], oFilePrefix=oFilePrefix))
-    simulatorRun(ifileName, h.origin, transferManager, policies
-        [policyStr], interfaces, oFile)
+    simulatorRun(ifileName, origin, transferManager, policy, interfaces, oFile, compact)
     oFile.write(',\n')
 
     oFile.write("{}]}")
@@ -9,8 +9,8 @@ from simulator.globals import *
 from simulator.transferManager import *
 from simulator.interface import Interface
 from simulator.policy import *
-from harParser import HarParser
-from simulator.eventSimulator import NOPREDICT
+from workload import readPage
+from simulator.eventSimulator import NOPREDICT, setupLogging
 
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
@@ -20,6 +20,7 @@ __license__ = "RELAXED CRAPL v0 BETA 1"
 
 logger = logging.getLogger("main")
 logging.disable(logging.DEBUG)
+setupLogging()
 
 def childTimingSum(transfer, parentTime):
     durationCandidate = 0
@@ -57,10 +58,7 @@ if __name__ == "__main__":
     infileSite, infileDate, infileTime = ifileName[:-4].split('+')
 
     transferManager = TransferManager()
-    fh = open(ifileName)
-    h = HarParser(fh, transferManager, verification=True)
-    h.generateTransfers()
-    fh.close()
+    origin = readPage(ifileName, transferManager, verification=True)
 
     actualDuration = 0
     for transfer in transferManager.transfers:
@@ -77,7 +75,7 @@ if __name__ == "__main__":
 
             #logger.debug("actualDuration: {0}".format(actualDuration))
 
-    rtt = searchForRttEstimate(h.origin, sys.argv[2])
+    rtt = searchForRttEstimate(origin, sys.argv[2])
     if not rtt:
         logger.error("Could not find RTT estimate - skipping")
         sys.exit(-1)
@@ -90,4 +88,4 @@ if __name__ == "__main__":
     (result, time) = transferManager.runTransfers([interface], policy)
 
     #"website", "crawl", "actual-time", "simulator-time"
-    print(",".join(map(lambda s: str(s), [h.origin, infileDate, actualDuration, time])))
+    print(",".join(map(lambda s: str(s), [origin, infileDate, actualDuration, time])))
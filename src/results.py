@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+""" one result store per sweep instead of one output file per simulator run
+
+usage: results.py <result-db>
+
+prints all runs of a result store as csv lines in the format of mainSingle.py.
+
+runs are appended to a sqlite database by a background thread, so simulations do not wait
+for the disk. runs of a sweep are stored with a key of everything that determines their
+result (see sweep.runKey) - sweeping into the same store again only simulates runs that are
+not in it yet. runs are written in transactions, so a crashed sweep leaves complete runs
+only. the store can be queried directly, e.g. all eaf runs with 2mbit on the first
+interface:
+
+    select website, loadTime from runs join interfaces on interfaces.run = runs.id
+        where policy like 'earliestArrivalFirst%' and position = 0 and bandwidth = 262144.0
+
+tables:
+    runs            id, website, crawl, crawlTime, policy, loadTime, key
+    interfaces      run, position, description, bandwidth, rtt
+    transfers       run, transfer, origin, ssl, size, startTime, enableTime, enqueueTime, finishTime
+                    (only if per-transfer times are written)
+"""
+
+import sys, os
+import sqlite3
+import threading
+import queue
+import logging
+from itertools import chain
+
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+logger = logging.getLogger("results")
+
+# runs written per transaction
+CHUNK_RUNS = 256
+
+SCHEMA = """
+    create table if not exists runs (id integer primary key, website text, crawl text, crawlTime text, policy text, loadTime real, key text);
+    create table if not exists interfaces (run integer, position integer, description text, bandwidth real, rtt real);
+    create table if not exists transfers (run integer, transfer integer, origin text, ssl integer, size integer,
+                                          startTime real, enableTime real, enqueueTime real, finishTime real);
+    create unique index if not exists runsKey on runs (key);
+    create index if not exists runsPolicy on runs (policy);
+    create index if not exists runsWebsite on runs (website, crawl, crawlTime);
+    create index if not exists interfacesParameters on interfaces (position, bandwidth, rtt);
+    create index if not exists interfacesRun on interfaces (run);
+    create index if not exists transfersRun on transfers (run);
+"""
+
+
+def _connect(fileName):
+    # concurrent sweeps into one store wait for each other's transactions
+    db = sqlite3.connect(fileName, timeout=60)
+    # stores written before runs had keys
+    columns = [c[1] for c in db.execute("pragma table_info(runs)")]
+    if columns and 'key' not in columns:
+        db.execute("alter table runs add column key text")
+    db.executescript(SCHEMA)
+    return db
+
+
+def transferTimes(transferManager):
+    """ per-transfer times of a finished run - (id, origin, ssl, size, start, enable, enqueue, finish) """
+    if transferManager.columns:
+        times = transferManager.columns.getTimes()
+        return [(t.id, t.origin, t.ssl, t.size, times['startTime'][row], times['enableTime'][row], times['enqueueTime'][row], times['finishTime'][row])
+                for (row, t) in enumerate(transferManager.transfers)]
+
+    rows = []
+    for t in transferManager.transfers:
+        times = t.getTimes()
+        rows.append((t.id, t.origin, t.ssl, t.size, times['startTime'], times['enableTime'], times['enqueueTime'], times['finishTime']))
+    return rows
+
+
+class ResultWriter(object):
+    """ appends runs to a result store from a background thread
+
+    runs are dicts as returned by sweep.runPoint - per-transfer times are written if a run has 'transfers'.
+    runs with a 'key' that is already stored are dropped - their transfer times are added if they were
+    stored without
+    """
+
+    def __init__(self, fileName, chunkRuns=CHUNK_RUNS):
+        self.fileName = fileName
+        self.chunkRuns = chunkRuns
+        self.queue = queue.Queue(maxsize=4 * chunkRuns)
+        self.error = None
+        self.thread = threading.Thread(target=self._write, name="ResultWriter", daemon=True)
+        self.thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+    def add(self, origin, infileDate, infileTime, run):
+        if self.error:
+            raise self.error
+        self.queue.put((origin, infileDate, infileTime, run))
+
+
+    def close(self):
+        """ wait until all runs are written - raises errors of the writer thread """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+    def _write(self):
+        db = None
+        done = False
+        try:
+            # sqlite connections stay in the thread that opened them
+            db = _connect(self.fileName)
+            while not done:
+                chunk = [self.queue.get()]
+                while chunk[-1] is not None and len(chunk) < self.chunkRuns:
+                    chunk.append(self.queue.get())
+                if chunk[-1] is None:
+                    chunk.pop()
+                    done = True
+                with db:
+                    for item in chunk:
+                        self._insert(db, *item)
+
+        except Exception as e:
+            logger.error("writing results to {f} failed: {e}".format(f=self.fileName, e=e))
+            self.error = e
+            # keep draining so producers do not block forever
+            while not done:
+                done = self.queue.get() is None
+        finally:
+            if db:
+                db.close()
+
+
+    def _insert(self, db, origin, infileDate, infileTime, run):
+        cursor = db.execute("insert or ignore into runs (website, crawl, crawlTime, policy, loadTime, key) values (?, ?, ?, ?, ?, ?)",
+                            (origin, infileDate, infileTime, run['policy'], run['time'], run.get('key')))
+        if cursor.rowcount:
+            runId = cursor.lastrowid
+            db.executemany("insert into interfaces values (?, ?, ?, ?, ?)",
+                           [(runId, n, i['description'], i['bandwidth'], i['rtt']) for (n, i) in enumerate(run['interfaces'])])
+        elif run.get('transfers'):
+            # stored by a sweep without transfer times - add them
+            (runId,) = db.execute("select id from runs where key = ?", (run['key'],)).fetchone()
+            if db.execute("select 1 from transfers where run = ? limit 1", (runId,)).fetchone():
+                return
+        else:
+            return
+        if run.get('transfers'):
+            db.executemany("insert into transfers values (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(runId,) + t for t in run['transfers']])
+
+
+
+def storedKeys(fileName, transfers=False):
+    """ keys of all runs in a result store - empty if there is no store yet
+
+    with transfers, only runs stored with the times of their transfers count
+    """
+    if not os.path.exists(fileName):
+        return set()
+    db = _connect(fileName)
+    try:
+        if transfers:
+            return {key for (key,) in db.execute("select key from runs where key is not null and exists (select 1 from transfers where transfers.run = runs.id)")}
+        return {key for (key,) in db.execute("select key from runs where key is not null")}
+    finally:
+        db.close()
+
+
+def readRuns(fileName):
+    """ yield (website, crawl, crawlTime, policy, [(bandwidth, rtt), ...], loadTime) of all runs in order """
+    db = sqlite3.connect(fileName)
+    try:
+        interfaces = {}
+        for (run, bandwidth, rtt) in db.execute("select run, bandwidth, rtt from interfaces order by run, position"):
+            interfaces.setdefault(run, []).append((bandwidth, rtt))
+        for (run, website, crawl, crawlTime, policy, loadTime) in db.execute("select id, website, crawl, crawlTime, policy, loadTime from runs order by id"):
+            yield (website, crawl, crawlTime, policy, interfaces.get(run, []), loadTime)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: results.py <result-db>", file=sys.stderr)
+        sys.exit(-1)
+
+    #"website", "crawl", "time", "policy", "if1_bw", "if1_rtt", ... "time"
+    for (website, crawl, crawlTime, policy, interfaces, loadTime) in readRuns(sys.argv[1]):
+        print(",".join(map(lambda s: str(s), [website, crawl, crawlTime, policy] + list(chain.from_iterable(interfaces)) + [loadTime])))
@@ -1,19 +1,57 @@
 """ abstract class for all kinds of simulated connection """
 
-from copy import copy
-from enum import Enum
-from simulator.eventSimulator import TickListener, NOPREDICT
+from simulator.eventSimulator import Event, TickListener, PredictionStorage
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
 __copyright__ = "Copyright 2017, FG INET, TU Berlin"
 __license__ = "RELAXED CRAPL v0 BETA 1"
 
 
-class state(Enum):
+# states and event kinds are plain integers - they are compared on every event
+
+class state(object):
     IDLE = 1
     BUSY = 2
     CLOSED = 3
 
+
+class eventKind(object):
+    HANDSHAKE_DONE = 1
+    SLOWSTART_ROUND = 2
+    TRANSFER_FINISH = 3
+    IDLE_TEARDOWN = 4
+
+# descriptions are only rendered for logging - ids are (connection id, transfer id)
+eventDescription = {
+    eventKind.HANDSHAKE_DONE:  "handshake delay done on connection id={0}",
+    eventKind.SLOWSTART_ROUND: "connection id={0} slowstart round finishing",
+    eventKind.TRANSFER_FINISH: "connection id={0} transfer id={1} finishing",
+    eventKind.IDLE_TEARDOWN:   "tear down idle connection id={0}",
+}
+
+
+class ConnectionEvent(Event):
+    """ event of a connection - identified by its kind and the ids involved """
+
+    __slots__ = ('conn', 'kind', 'ids')
+
+    def __init__(self, connection, time, kind, *ids):
+        super().__init__(time)
+        self.conn = connection
+        self.kind = kind
+        self.ids = ids
+
+
+    @property
+    def description(self):
+        return eventDescription[self.kind].format(*self.ids)
+
+
+    # compare without rendering descriptions
+    def isKind(self, kind, ids):
+        return self.kind == kind and self.ids == ids
+
+
 connectionCounterCounter = -1
 
 def connectionCounter():
@@ -21,12 +59,10 @@ def connectionCounter():
     connectionCounterCounter += 1
     return connectionCounterCounter
 
-class Connection(TickListener):
+class Connection(TickListener, PredictionStorage):
 
     def __init__(self, idleTimeout, ssl, origin, transferManager, eventSimulator):
         self.rStorage = Connection.ConnectionStorage()
-        self.pStorage = None
-        self.pRun = NOPREDICT
         self.idleTimeout = idleTimeout
         self.eventSimulator = eventSimulator
         self.transferManager = transferManager
@@ -36,27 +72,22 @@ class Connection(TickListener):
 
 
     class ConnectionStorage(object):
+
+        __slots__ = ('desiredBw', 'availableBw', 'idleTimestamp')
+
         def __init__(self):
             self.desiredBw = 0.0
             self.availableBw = 0.0
             self.idleTimestamp = None
 
         def clone(self):
-            clone = copy(self)
+            clone = Connection.ConnectionStorage.__new__(Connection.ConnectionStorage)
+            clone.desiredBw = self.desiredBw
+            clone.availableBw = self.availableBw
+            clone.idleTimestamp = self.idleTimestamp
             return clone
 
 
-    def _storageSwitch(self, pRun):
-        if self.pRun != pRun:
-            self.pStorage = self.rStorage.clone()
-            self.pRun = pRun
-
-        if pRun == NOPREDICT:
-            return self.rStorage
-        else:
-            return self.pStorage
-
-
     def _notifyNew(self, storage, time, pRun):
         assert storage.state == state.IDLE
 
@@ -77,33 +108,52 @@ class Connection(TickListener):
 
 
     def getIdleTimestamp(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.idleTimestamp
 
 
     def getDesiredBw(self, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.desiredBw
 
 
     def getAvailableBw(self, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.availableBw
 
 
+    # true if the connection has to be told its bandwidth share even if it did not change
+    def wantsBwShare(self, pRun):
+        return False
+
+
     def setAvailableBw(self, availableBw, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         
         # only do something if bandwidth changed
         if storage.availableBw != availableBw:
 
             # update local cache
+            storage = self._storageSwitch(pRun)
             storage.availableBw = availableBw
             
 
     def _tickTime(self, start, end, pRun):
         pass
 
+
+    # fluid engine - account for the time since the last call at the current rate
+    # must be called before the rate or the state changes or the progress is used
+    def _settle(self, time, pRun):
+        if not self.eventSimulator.fluid:
+            return
+
+        storage = self._storageRead(pRun)
+        if storage.lastTick != time:
+            if storage.state == state.BUSY:
+                self._tickTime(storage.lastTick, time, pRun)
+            self._storageSwitch(pRun).lastTick = time
+
         
     def __str__(self):
         return ""
@@ -0,0 +1,370 @@
+""" event queue backends for the event simulator
+
+all queues order events by time, can be cloned when the simulator is switched
+into prediction mode and tell the caller whether an event could be removed in
+place - if not, the simulator falls back to disabling the event
+"""
+
+from heapq import heappush, heappop
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+class EventQueue(object):
+
+    def push(self, event):
+        raise NotImplementedError
+
+
+    def pop(self):
+        raise NotImplementedError
+
+
+    def peek(self):
+        raise NotImplementedError
+
+
+    # remove event in place - returns False if the queue can not do that
+    def remove(self, event):
+        return False
+
+
+    # replace pending event by a new one - returns False if the old event is still queued
+    def replace(self, oldEvent, newEvent):
+        self.push(newEvent)
+        return self.remove(oldEvent)
+
+
+    def clone(self):
+        raise NotImplementedError
+
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+
+class HeapEventQueue(EventQueue):
+    """ plain binary heap - removed events stay in the heap and have to be disabled """
+
+    def __init__(self):
+        self.heap = []
+
+
+    def push(self, event):
+        heappush(self.heap, event)
+
+
+    def pop(self):
+        return heappop(self.heap)
+
+
+    def peek(self):
+        return self.heap[0]
+
+
+    def clone(self):
+        clone = HeapEventQueue()
+        clone.heap = self.heap[:]
+        return clone
+
+
+    def __len__(self):
+        return len(self.heap)
+
+
+
+class IndexedHeapEventQueue(EventQueue):
+    """ binary heap that keeps track of the position of each event
+
+    events can be removed or re-scheduled in place (decrease/increase key), so
+    replaced events do not pile up as disabled entries. as events are shared
+    between the real and the prediction queues, positions are kept in the
+    queue and not in the events themselves.
+    """
+
+    def __init__(self):
+        self.heap = []          # entries: [time, sequence number, event]
+        self.position = {}      # id(event) -> index into heap
+        self.sequence = 0
+
+
+    def _entry(self, event):
+        self.sequence += 1
+        return [event.time, self.sequence, event]
+
+
+    def _set(self, index, entry):
+        self.heap[index] = entry
+        self.position[id(entry[2])] = index
+
+
+    def _siftUp(self, index):
+        heap = self.heap
+        entry = heap[index]
+        while index > 0:
+            parentIndex = (index - 1) >> 1
+            parent = heap[parentIndex]
+            if entry < parent:
+                self._set(index, parent)
+                index = parentIndex
+            else:
+                break
+        self._set(index, entry)
+        return index
+
+
+    def _siftDown(self, index):
+        heap = self.heap
+        size = len(heap)
+        entry = heap[index]
+        childIndex = 2 * index + 1
+        while childIndex < size:
+            rightIndex = childIndex + 1
+            if rightIndex < size and heap[rightIndex] < heap[childIndex]:
+                childIndex = rightIndex
+            if heap[childIndex] < entry:
+                self._set(index, heap[childIndex])
+                index = childIndex
+                childIndex = 2 * index + 1
+            else:
+                break
+        self._set(index, entry)
+        return index
+
+
+    def _restore(self, index):
+        if self._siftUp(index) == index:
+            self._siftDown(index)
+
+
+    def push(self, event):
+        self.heap.append(self._entry(event))
+        self._siftUp(len(self.heap) - 1)
+
+
+    def pop(self):
+        heap = self.heap
+        last = heap.pop()
+        if heap:
+            entry = heap[0]
+            self._set(0, last)
+            self._siftDown(0)
+        else:
+            entry = last
+        del self.position[id(entry[2])]
+        return entry[2]
+
+
+    def peek(self):
+        return self.heap[0][2]
+
+
+    def remove(self, event):
+        index = self.position.pop(id(event), None)
+        if index is None:
+            return False
+
+        last = self.heap.pop()
+        if index < len(self.heap):
+            self._set(index, last)
+            self._restore(index)
+        return True
+
+
+    def replace(self, oldEvent, newEvent):
+        index = self.position.pop(id(oldEvent), None)
+        if index is None:
+            self.push(newEvent)
+            return False
+
+        # re-use slot of the old event and move it to its new position
+        self._set(index, self._entry(newEvent))
+        self._restore(index)
+        return True
+
+
+    def clone(self):
+        clone = IndexedHeapEventQueue()
+        clone.heap = self.heap[:]
+        clone.position = self.position.copy()
+        clone.sequence = self.sequence
+        return clone
+
+
+    def __len__(self):
+        return len(self.heap)
+
+
+
+class CalendarEventQueue(EventQueue):
+    """ calendar (bucket) queue
+
+    events are hashed into buckets of fixed width, only the bucket numbers are
+    kept in a heap. slow start rounds of parallel connections produce many
+    events with (nearly) the same timestamps that end up in few buckets.
+
+    removed events are only dropped from the entry index and stay in their
+    bucket as tombstones until they reach its front - entries are shared with
+    clones, so they can not be marked themselves.
+    """
+
+    DEFAULT_BUCKET_WIDTH = 0.001
+
+    def __init__(self, bucketWidth=DEFAULT_BUCKET_WIDTH):
+        assert bucketWidth > 0
+
+        self.bucketWidth = bucketWidth
+        self.buckets = {}       # bucket number -> heap of entries [time, sequence number, event]
+        self.bucketHeap = []    # heap of bucket numbers
+        self.entries = {}       # id(event) -> entry, for queued events only
+        self.size = 0
+        self.sequence = 0
+
+
+    def _bucket(self, time):
+        return int(time // self.bucketWidth)
+
+
+    def push(self, event):
+        self.sequence += 1
+        entry = [event.time, self.sequence, event]
+        bucketNumber = self._bucket(event.time)
+
+        bucket = self.buckets.get(bucketNumber)
+        if bucket is None:
+            bucket = self.buckets[bucketNumber] = []
+            heappush(self.bucketHeap, bucketNumber)
+        heappush(bucket, entry)
+
+        self.entries[id(event)] = entry
+        self.size += 1
+
+
+    # drop tombstones and empty buckets in front of the first queued entry
+    def _firstBucket(self):
+        entries = self.entries
+        while True:
+            bucketNumber = self.bucketHeap[0]
+            bucket = self.buckets[bucketNumber]
+            while bucket and entries.get(id(bucket[0][2])) is not bucket[0]:
+                heappop(bucket)
+            if bucket:
+                return bucket
+            del self.buckets[bucketNumber]
+            heappop(self.bucketHeap)
+
+
+    def pop(self):
+        entry = heappop(self._firstBucket())
+        del self.entries[id(entry[2])]
+        self.size -= 1
+        return entry[2]
+
+
+    def peek(self):
+        return self._firstBucket()[0][2]
+
+
+    def remove(self, event):
+        if self.entries.pop(id(event), None) is None:
+            return False
+
+        self.size -= 1
+        return True
+
+
+    def clone(self):
+        clone = CalendarEventQueue(self.bucketWidth)
+        clone.buckets = {n: b[:] for (n, b) in self.buckets.items()}
+        clone.bucketHeap = self.bucketHeap[:]
+        clone.entries = self.entries.copy()
+        clone.size = self.size
+        clone.sequence = self.sequence
+        return clone
+
+
+    def __len__(self):
+        return self.size
+
+
+
+class PersistentEventQueue(EventQueue):
+    """ persistent leftist heap
+
+    nodes are immutable tuples (rank, time, sequence number, event, left, right)
+    and are shared between a queue and all its clones. forking the queue for a
+    prediction run is O(1) and dropping a prediction branch costs nothing, every
+    push/pop only allocates the O(log n) nodes on the merge path.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+        self.sequence = 0
+
+
+    @staticmethod
+    def _merge(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if b[1] < a[1] or b[1] == a[1] and b[2] < a[2]:
+            a, b = b, a
+
+        # merge along the right spine and keep the leftist property
+        left = a[4]
+        right = PersistentEventQueue._merge(a[5], b)
+        if left is None or left[0] < right[0]:
+            left, right = right, left
+        rank = right[0] + 1 if right is not None else 1
+        return (rank, a[1], a[2], a[3], left, right)
+
+
+    def push(self, event):
+        self.sequence += 1
+        node = (1, event.time, self.sequence, event, None, None)
+        self.root = PersistentEventQueue._merge(self.root, node)
+        self.size += 1
+
+
+    def pop(self):
+        root = self.root
+        self.root = PersistentEventQueue._merge(root[4], root[5])
+        self.size -= 1
+        return root[3]
+
+
+    def peek(self):
+        return self.root[3]
+
+
+    def clone(self):
+        clone = PersistentEventQueue()
+        clone.root = self.root
+        clone.size = self.size
+        clone.sequence = self.sequence
+        return clone
+
+
+    def __len__(self):
+        return self.size
+
+
+
+# available backends, selectable per simulator run
+EVENT_QUEUES = {'heap': HeapEventQueue,
+                'indexed': IndexedHeapEventQueue,
+                'calendar': CalendarEventQueue,
+                'persistent': PersistentEventQueue}
+
+DEFAULT_EVENT_QUEUE = 'heap'
+
+
+def createEventQueue(name=DEFAULT_EVENT_QUEUE):
+    if name not in EVENT_QUEUES:
+        raise ValueError("unknown event queue backend: {name}".format(name=name))
+    return EVENT_QUEUES[name]()
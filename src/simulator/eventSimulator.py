@@ -5,25 +5,28 @@ this simulator can be switched into predictions mode and can return to last non-
 """
 
 import logging
-from heapq import *
-from copy import copy
+from simulator.eventQueue import createEventQueue, DEFAULT_EVENT_QUEUE
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
 __copyright__ = "Copyright 2017, FG INET, TU Berlin"
 __license__ = "RELAXED CRAPL v0 BETA 1"
 
 
-# logging format setup
-logging.basicConfig(format='[{levelname:<6}]{filename:>20}.{funcName:<24}l{lineno:>3} {message}', style='{', level="DEBUG")
-
 # we are not running in prediction mode
 NOPREDICT = -1
 
+# tick: all tick listeners are ticked whenever time advances
+# fluid: rates are constant between events, listeners account for elapsed time when used
+ENGINES = ('tick', 'fluid')
+DEFAULT_ENGINE = 'tick'
+
 class timeLogAdapter:
 
     class CustomAdapter(logging.LoggerAdapter):
         def process(self, msg, kwargs):
-            if self.extra['time'] == None:
+            if not self.extra['tracking']:
+                return "t=untracked {msg}".format(msg=msg), kwargs
+            elif self.extra['time'] == None:
                 return "---- no sim ---- {msg}".format(msg=msg), kwargs
             elif self.extra['pRun'] == NOPREDICT:
                 return "p=real t={time:3.4f}s {msg}".format(time=self.extra['time'], msg=msg), kwargs
@@ -32,14 +35,21 @@ class timeLogAdapter:
 
 
     def __init__(self):
-        self.extra = {'time': None, 'pRun': NOPREDICT}
+        self.extra = {'time': None, 'pRun': NOPREDICT, 'tracking': True}
+        self.tracking = True
 
 
+    # callers check tracking first - updating the time on every tick is not for free
     def updateTime(self, time, pRun):
         self.extra['time'] = time
         self.extra['pRun'] = pRun
 
 
+    def setTracking(self, tracking):
+        self.tracking = tracking
+        self.extra['tracking'] = tracking
+
+
     def setup(self, name):
         logger = logging.getLogger(name)
         logger = timeLogAdapter.CustomAdapter(logger, self.extra)
@@ -51,6 +61,82 @@ logAdapter = timeLogAdapter()
 logger = logAdapter.setup("eventSimulator")
 
 
+def setupLogging(fast=False):
+    """ logging setup - to be called once at startup by the main programs
+
+    fast mode is meant for batch runs without debug output: log messages do not
+    carry the simulated time any more, which saves the bookkeeping on every tick.
+    """
+    logging.basicConfig(format='[{levelname:<6}]{filename:>20}.{funcName:<24}l{lineno:>3} {message}', style='{', level="INFO" if fast else "DEBUG")
+    logAdapter.setTracking(not fast)
+
+
+class PredictionState(object):
+    """ copy-on-write overlay for the state of all simulated objects
+
+    during a prediction run, objects read their real storage until they change
+    it - the first write clones the real storage into the overlay of the current
+    run. all overlays are released at once when the prediction ends, so the cost
+    of a prediction scales with the objects it actually touches.
+    """
+
+    def __init__(self):
+        self.owner = None       # simulator running the prediction
+        self.pRun = NOPREDICT
+        self.overlays = {}
+
+
+    def begin(self, owner, pRun):
+        assert self.owner is None, "simulator started a prediction while another one is predicting"
+        self.owner = owner
+        self.pRun = pRun
+        self.overlays = {}
+
+
+    def end(self, owner, pRun):
+        assert self.owner is owner and self.pRun == pRun
+        self.owner = None
+        self.pRun = NOPREDICT
+        self.overlays = {}
+
+
+# overlays are process-global - only one simulator may predict at a time
+predictionState = PredictionState()
+
+
+class PredictionStorage(object):
+    """ mixin for objects that keep their real state in self.rStorage """
+
+    def _storageInit(self, storage, pRun):
+        # objects created during a prediction run only exist in its overlay
+        if pRun == NOPREDICT:
+            self.rStorage = storage
+        else:
+            assert pRun == predictionState.pRun
+            self.rStorage = None
+            predictionState.overlays[self] = storage
+
+
+    # storage for write access - clones real storage on first write in a prediction run
+    def _storageSwitch(self, pRun):
+        if pRun == NOPREDICT:
+            return self.rStorage
+
+        storage = predictionState.overlays.get(self)
+        if storage is None:
+            assert pRun == predictionState.pRun
+            storage = predictionState.overlays[self] = self.rStorage.clone()
+        return storage
+
+
+    # storage for read access - never clones
+    def _storageRead(self, pRun):
+        if pRun == NOPREDICT:
+            return self.rStorage
+        return predictionState.overlays.get(self, self.rStorage)
+
+
+
 class TickListener(object):
 
     def _tickTime(self, start, end, pRun):
@@ -61,14 +147,36 @@ class TickListener(object):
 
 
 
+class BatchListener(object):
+
+    def _settleBatch(self, time, pRun):
+        pass
+
+    def settleBatch(self, time, pRun):
+        self._settleBatch(time, pRun)
+
+
+
 class Event(object):
 
-    def __init__(self, time, description=""):
+    # events are created on every re-schedule - keep them small
+    __slots__ = ('time', 'rDisabled', 'pDisabled', 'pRun', 'descriptionTemplate', 'descriptionArgs')
+
+    # description is a format string that is only rendered when needed
+    def __init__(self, time, description="", **descriptionArgs):
         self.time = time
         self.rDisabled = False
         self.pDisabled = False
         self.pRun = NOPREDICT
-        self.description = description
+        self.descriptionTemplate = description
+        self.descriptionArgs = descriptionArgs or None
+
+
+    @property
+    def description(self):
+        if not self.descriptionArgs:
+            return self.descriptionTemplate
+        return self.descriptionTemplate.format(**self.descriptionArgs)
 
 
     def __eq__(self, other):
@@ -119,22 +227,56 @@ class EventSimulator(object):
     # container to hold state that might be changed during prediction runs
     class EventSimulatorStorage(object):
 
-        def __init__(self):
+        __slots__ = ('time', 'pRun', 'eventCount', 'eventQueue', 'tickListener', 'tickListenerShared', 'dirty', 'dirtyConnections', 'batchListener')
+
+        def __init__(self, eventQueue):
             self.time = 0.0
             self.pRun = NOPREDICT
-            self.eventQueue = []
+            self.eventCount = 0
+            self.eventQueue = eventQueue
             self.tickListener = []
+            self.tickListenerShared = False
+            self.dirty = {}     # interface -> connections with changed desired bandwidth
+            self.dirtyConnections = []      # connections that sum up bandwidth shares of others
+            self.batchListener = []     # listeners to settle once the current batch of events is handled
 
         def clone(self):
-            clone = copy(self)
-            clone.eventQueue   = self.eventQueue[:]
-            clone.tickListener = self.tickListener[:]
+            # tick listeners are copied on first change only
+            clone = EventSimulator.EventSimulatorStorage.__new__(EventSimulator.EventSimulatorStorage)
+            clone.time = self.time
+            clone.pRun = self.pRun
+            clone.eventCount = self.eventCount
+            clone.eventQueue   = self.eventQueue.clone()
+            clone.tickListener = self.tickListener
+            clone.tickListenerShared = True
+            clone.dirty = {i: c[:] for (i, c) in self.dirty.items()}
+            clone.dirtyConnections = self.dirtyConnections[:]
+            clone.batchListener = self.batchListener[:]
             return clone
 
+        def getTickListener(self):
+            if self.tickListenerShared:
+                self.tickListener = self.tickListener[:]
+                self.tickListenerShared = False
+            return self.tickListener
+
+
+    def __init__(self, eventQueue=DEFAULT_EVENT_QUEUE, engine=DEFAULT_ENGINE, coalesceUpdates=True, skipUnchangedShares=False):
+        if engine not in ENGINES:
+            raise ValueError("unknown simulator engine: {engine}".format(engine=engine))
 
-    def __init__(self):
         # state for real execution
-        self.rStorage = EventSimulator.EventSimulatorStorage()
+        self.rStorage = EventSimulator.EventSimulatorStorage(createEventQueue(eventQueue))
+
+        # fluid engine - tick listeners account for elapsed time themselves when they are used
+        self.fluid = engine == 'fluid'
+
+        # re-calculate bandwidth shares and notify batch listeners once per timestamp
+        self.coalesceUpdates = coalesceUpdates
+
+        # only tell slowstart connections about bandwidth shares that changed - their rounds
+        # are no longer restarted by updates of other connections, which alters results
+        self.skipUnchangedShares = skipUnchangedShares
 
         # state for current prediction run
         self.pStorage = None
@@ -144,7 +286,8 @@ class EventSimulator(object):
         self.pRunLast = -1
 
         # fix logging
-        logAdapter.updateTime(self.rStorage.time, self.rStorage.pRun)
+        if logAdapter.tracking:
+            logAdapter.updateTime(self.rStorage.time, self.rStorage.pRun)
 
 
 
@@ -161,12 +304,14 @@ class EventSimulator(object):
         assert self.pRun == NOPREDICT
 
         # fix prun state
+        predictionState.begin(self, self.pRunLast + 1)
         self.pStorage = self.rStorage.clone()
         self.pStorage.pRun = self.pRunLast + 1
         self.pRun = self.pStorage.pRun
 
         # fix logging
-        logAdapter.updateTime(self.pStorage.time, self.pStorage.pRun)
+        if logAdapter.tracking:
+            logAdapter.updateTime(self.pStorage.time, self.pStorage.pRun)
 
         return self.pRun
 
@@ -177,6 +322,10 @@ class EventSimulator(object):
         self.pRunLast = self.pRun
         self.pRun = NOPREDICT
 
+        # drop prediction branch and the state of all objects touched
+        self.pStorage = None
+        predictionState.end(self, pRun)
+
         #logger.debug("marking pRun={pRun} as finished - might have some stragglers on call stack".format(pRun=pRun))
 
 
@@ -187,6 +336,14 @@ class EventSimulator(object):
         return storage.time
 
 
+    # number of events handled so far
+    def getEventCount(self, pRun):
+        assert self.pRun == pRun
+
+        storage = self._storageSwitch(pRun)
+        return storage.eventCount
+
+
     def addEvent(self, event, pRun = NOPREDICT):
         #logger.debug("adding Event: {1}".format(event))
 
@@ -195,49 +352,158 @@ class EventSimulator(object):
             #logger.debug("ignoring straggler event from finished pRun")
         else:
             storage = self._storageSwitch(pRun)
-            heappush(storage.eventQueue, event)
+            storage.eventQueue.push(event)
+
+
+    def removeEvent(self, event, pRun = NOPREDICT):
+        # remove from queue if the backend supports it - disable otherwise
+        if pRun != self.pRun or not self._storageSwitch(pRun).eventQueue.remove(event):
+            event.disableEvent(pRun)
+
+
+    def replaceEvent(self, oldEvent, newEvent, pRun = NOPREDICT):
+        if pRun != self.pRun:
+            assert pRun != NOPREDICT
+            oldEvent.disableEvent(pRun)
+        else:
+            # re-schedule in place if the backend supports it - disable otherwise
+            storage = self._storageSwitch(pRun)
+            if not storage.eventQueue.replace(oldEvent, newEvent):
+                oldEvent.disableEvent(pRun)
 
 
     def registerTickListener(self, tickListener, pRun = NOPREDICT):
+        if self.fluid:
+            return
         storage = self._storageSwitch(pRun)
-        storage.tickListener.append(tickListener)   
+        storage.getTickListener().append(tickListener)
 
 
     def unregisterTickListener(self, tickListener, pRun = NOPREDICT):
+        if self.fluid:
+            return
+        storage = self._storageSwitch(pRun)
+        storage.getTickListener().remove(tickListener)
+
+
+    # bandwidth shares of interface have to be re-calculated as the desired bandwidth of connection changed
+    def updateBwShare(self, interface, connection, time, pRun):
+        if not self.coalesceUpdates:
+            interface.updateConnectionBwShare(time, pRun, connection)
+            return
+
+        storage = self._storageSwitch(pRun)
+        connections = storage.dirty.get(interface)
+        if connections is None:
+            storage.dirty[interface] = [connection]
+        elif connection not in connections:
+            connections.append(connection)
+
+
+    # available bandwidth of connection depends on bandwidth shares - collect it once they are settled
+    def updateAvailableBw(self, connection, time, pRun):
+        if not self.coalesceUpdates:
+            connection.collectAvailableBw(time, pRun)
+            return
+
+        storage = self._storageSwitch(pRun)
+        if connection not in storage.dirtyConnections:
+            storage.dirtyConnections.append(connection)
+
+
+    # listener is told once all events of the current timestamp are handled and bandwidth shares are settled
+    def settleAfterBatch(self, listener, time, pRun):
+        if not self.coalesceUpdates:
+            listener.settleBatch(time, pRun)
+            return
+
         storage = self._storageSwitch(pRun)
-        storage.tickListener.remove(tickListener)
+        if listener not in storage.batchListener:
+            storage.batchListener.append(listener)
+
+
+    def _isSettled(self, storage):
+        return not (storage.dirty or storage.dirtyConnections or storage.batchListener)
+
+
+    # post-batch phase - settle bandwidth shares first, then tell batch listeners
+    # listeners might change bandwidth needs again, so repeat until nothing is left
+    def _settleBatch(self, storage, pRun):
+        while not self._isSettled(storage) and self.pRun == pRun:
+            dirty = storage.dirty
+            storage.dirty = {}
+            for (interface, connections) in dirty.items():
+                interface.updateConnectionBwShare(storage.time, pRun, *connections)
+
+            dirtyConnections = storage.dirtyConnections
+            storage.dirtyConnections = []
+            for connection in dirtyConnections:
+                connection.collectAvailableBw(storage.time, pRun)
+
+            if storage.dirty or storage.dirtyConnections:
+                continue
+
+            batchListener = storage.batchListener
+            storage.batchListener = []
+            for listener in batchListener:
+                if self.pRun != pRun:
+                    break
+                listener.settleBatch(storage.time, pRun)
 
 
     def _tickTime(self, storage, eventTime, nextEventTime, pRun):
         #logger.debug("ticking time from {start:.6f}s to {end:.6f}s".format(start=eventTime, end=nextEventTime))
         for tickListener in storage.tickListener:
             tickListener.tickTime(eventTime, nextEventTime, pRun)
-        logAdapter.updateTime(nextEventTime, pRun)
+        if logAdapter.tracking:
+            logAdapter.updateTime(nextEventTime, pRun)
 
 
-    def _run(self, storage, pRun):
-        assert storage.eventQueue
+    def _run(self, storage, pRun, bound=float('Inf')):
+        # predictions may start from a real batch that is not settled yet
+        assert storage.eventQueue or not self._isSettled(storage)
         assert self.pRun == pRun
 
         # main simulator run
-        while self.pRun == pRun and storage.eventQueue:
+        while self.pRun == pRun:
             assert storage.pRun == pRun
 
+            # settle the last batch before time advances
+            if not self._isSettled(storage):
+                self._settleBatch(storage, pRun)
+                continue
+
+            if not storage.eventQueue:
+                break
+
             # get next event
-            event = heappop(storage.eventQueue)
+            event = storage.eventQueue.pop()
             if event.isDisabled(pRun):
                 continue
 
+            # stop once time would pass the bound
+            if event.time > bound:
+                return False
+
             # tick time if time changed
             if event.time > storage.time:
                 self._tickTime(storage, storage.time, event.time, pRun)
 
-            # handle event
+            # handle all events of this timestamp as one batch - events are popped one by one
+            # as handlers might still remove or replace events of the same timestamp
             assert storage.time <= event.time
             storage.time = event.time
-            event.handleEvent(self, event.time, pRun)
+            while True:
+                if not event.isDisabled(pRun):
+                    storage.eventCount += 1
+                    event.handleEvent(self, event.time, pRun)
+
+                if self.pRun != pRun or not storage.eventQueue or storage.eventQueue.peek().time != storage.time:
+                    break
+                event = storage.eventQueue.pop()
 
         #logger.debug("finished simulator loop")
+        return True
 
 
     def realRun(self):
@@ -247,14 +513,20 @@ class EventSimulator(object):
         self._run(storage, NOPREDICT)
 
 
-    def predictionRun(self, pRun):
+    # run prediction until it is ended - returns False if it was cut off at bound instead
+    def predictionRun(self, pRun, bound=float('Inf')):
         assert self.pRun == pRun
 
         storage = self.pStorage
-        self._run(storage, pRun)
+        finished = self._run(storage, pRun, bound)
+        if not finished:
+            self.endPrecition(pRun)
 
         # fix logging
-        logAdapter.updateTime(self.rStorage.time, self.pRun)
+        if logAdapter.tracking:
+            logAdapter.updateTime(self.rStorage.time, self.pRun)
+
+        return finished
 
 
 
@@ -14,3 +14,7 @@ def bwUnit(bw):
 	return "{bw:.0f}kbps".format(bw=kbps) if kbps < 1024 else "{bw:.3f}Mbps".format(bw=kbps/1024)
 
 progressFH = sys.stderr
+
+# version of the simulation results - bump it with every change that alters them,
+# so results cached by earlier versions are not reused
+SIMULATOR_VERSION = 2
@@ -3,9 +3,9 @@
 main use is to tell connections the bandwidth share they will get to progress transfers
 """
 
-from copy import copy
+from bisect import insort, bisect_left, bisect_right
 from simulator.globals import toMB, bwUnit
-from simulator.eventSimulator import logAdapter, NOPREDICT
+from simulator.eventSimulator import logAdapter, NOPREDICT, PredictionStorage, predictionState
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
 __copyright__ = "Copyright 2017, FG INET, TU Berlin"
@@ -14,7 +14,7 @@ __license__ = "RELAXED CRAPL v0 BETA 1"
 
 logger = logAdapter.setup("interface")
 
-class Interface(object):
+class Interface(PredictionStorage):
 
     def __init__(self, rtt, bandwidth, description):
         assert rtt > 0
@@ -24,35 +24,34 @@ class Interface(object):
         self.rtt = rtt
         self.bandwidth = bandwidth
         self.rStorage = Interface.InterfaceStorage()
-        self.pStorage = None
-        self.pRun = NOPREDICT
         self.description = description
 
 
     class InterfaceStorage(object):
+
+        __slots__ = ('connections', 'demands', 'demand', 'share')
+
         def __init__(self):
             self.connections = []
+            self.demands = []       # sorted (desired bandwidth, connection id, connection)
+            self.demand = {}        # connection -> desired bandwidth as in demands
+            self.share = {}         # connection -> bandwidth share last handed out
 
         def clone(self):
-            clone = copy(self)
+            clone = Interface.InterfaceStorage.__new__(Interface.InterfaceStorage)
             clone.connections = self.connections[:]
+            clone.demands = self.demands[:]
+            clone.demand = self.demand.copy()
+            clone.share = self.share.copy()
             return clone
 
-    def _storageSwitch(self, pRun):
-        if self.pRun != pRun:
-            self.pStorage = self.rStorage.clone()
-            self.pRun = pRun
-
-        if pRun == NOPREDICT:
-            return self.rStorage
-        else:
-            return self.pStorage
-
-
     def reset(self):
         self.rStorage = Interface.InterfaceStorage()
-        self.pStorage = None
-        self.pRun = NOPREDICT
+
+
+    def instantiate(self):
+        """ interface with the same parameters and no connections for a simulation run """
+        return Interface(self.rtt, self.bandwidth, self.description)
 
 
     def getRTT(self):
@@ -63,19 +62,52 @@ class Interface(object):
         storage = self._storageSwitch(pRun)
         assert not connection in storage.connections
         storage.connections.append(connection)
+        self._setDemand(storage, connection, 0)
+        storage.share[connection] = 0
 
 
     def removeConnection(self, connection, pRun):
         storage = self._storageSwitch(pRun)
         storage.connections.remove(connection)
+        storage.demands.remove((storage.demand.pop(connection), connection.id, connection))
+        del storage.share[connection]
+
+
+    # keep demands sorted - connection ids make entries unique
+    def _setDemand(self, storage, connection, demand):
+        assert demand >= 0
+        oldDemand = storage.demand.get(connection)
+        if oldDemand == demand:
+            return
+        if oldDemand is not None:
+            del storage.demands[bisect_left(storage.demands, (oldDemand, connection.id))]
+        insort(storage.demands, (demand, connection.id, connection))
+        storage.demand[connection] = demand
 
 
     def getConnections(self, pRun=NOPREDICT):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.connections
 
 
-    def updateConnectionBwShare(self, time, pRun):
+    # true if no connection on this interface is or will become busy on its own
+    def isUncontended(self, pRun=NOPREDICT):
+        storage = self._storageRead(pRun)
+        for c in storage.connections:
+            if not c.isQuiescent(pRun):
+                return False
+        return True
+
+
+    def updateConnectionBwShare(self, time, pRun, *changed):
+        """ max-min fair share of the interface bandwidth after the desired bandwidth of changed connections changed
+
+        demands are kept sorted, so connections that want less than an equal share
+        get what they want and the rest is split evenly between the others. only
+        changed connections, connections whose share changed and connections that
+        want to be told anyway (see wantsBwShare) are told - without changed
+        connections, all demands are re-read and all connections are told.
+        """
         storage = self._storageSwitch(pRun)
         if not storage.connections:
             #logger.debug("updating {iface} bandwidth shares: no connections".format(iface=self.description))
@@ -83,50 +115,41 @@ class Interface(object):
 
         #logger.debug("updating {iface} bandwidth shares".format(iface=self.description))
 
-        # make sure we have no negative bw connctions
-        assert not [ c for c in storage.connections if c.getDesiredBw(time, pRun) < 0 ]
-        # list of idle connections
-        connIDLE = [ c for c in storage.connections if c.getDesiredBw(time, pRun) == 0 ]
-        # list of bandwidth-limited connections (congestions avoidence or late slow-strat)
-        connBWB = [ c for c in storage.connections if c.getDesiredBw(time, pRun) > 0 ]
-        # list of low bandwidth connections (early late slow-strat)
-        connLBW = []
-
-        # set available bandwidth for all idle connctions
-        #logger.debug("found {count} idle connctions".format(count=len(connIDLE)))
-        for c in connIDLE:
-            c.setAvailableBw(0, time, pRun)
-        
-        # iterate over all badwith-limited connctions and re-classify as 
-        # low bandwidth if neccessary - break once the calculation converges
-        bwLowSum = 0
-        bwShare = 0
-        round = 0
-        maxRounds = len(storage.connections)
-        while connBWB and bwShare != int( (self.bandwidth - bwLowSum) / len(connBWB) ):
-            assert maxRounds > round
-            assert bwShare >= 0
-            bwShare = int( (self.bandwidth - bwLowSum) / len(connBWB) )
-            #logger.debug("calculation round {round} - bwShare={bwShare} bwLowSum={bwLowSum}".format(round=round, bwShare=bwUnit(bwShare), bwLowSum=bwUnit(bwLowSum)))
-            for c in connBWB:
-                # check if desired bandwidth dropped below the bwshare
-                desiredBw = int(c.getDesiredBw(time, pRun))
-                if desiredBw <= bwShare:
-                    # move to low bandwidth connctions
-                    connBWB.remove(c)
-                    connLBW.append(c)
-                    # update low bandwidth sum
-                    bwLowSum += desiredBw
-                    c.setAvailableBw(desiredBw, time, pRun)
-            round += 1
-        
-        #logger.debug("calculation done")
-        #logger.debug("found {bwb} bandwidth bound connctions – bwShare={bwShare}".format(bwb=len(connBWB), bwShare=bwUnit(bwShare)))
-        #logger.debug("found {low} low bandwidth connections – bwLowSum={bwLowSum}".format(low=len(connLBW), bwLowSum=bwUnit(bwLowSum)))
-
-        # we are done - set available bandwidth for all bandwidth bound connctions
-        for c in connBWB:
-            c.setAvailableBw(bwShare, time, pRun)
+        # connections might have been closed since they changed
+        changed = [c for c in changed if c in storage.demand] if changed else storage.connections
+        for c in changed:
+            self._setDemand(storage, c, int(c.getDesiredBw(time, pRun)))
+        changed = set(changed)
+
+        # fill up from the lowest demand - idle connections come first and get nothing
+        demands = storage.demands
+        first = bisect_right(demands, (0, float('Inf')))
+        bwRemaining = self.bandwidth
+        bwBound = len(demands) - first
+        share = {}
+        for (demand, _, c) in demands[first:]:
+            bwShare = int(bwRemaining / bwBound)
+            if demand > bwShare:
+                break
+            share[c] = demand
+            bwRemaining -= demand
+            bwBound -= 1
+        bwShare = int(bwRemaining / bwBound) if bwBound else 0
+
+        #logger.debug("found {bwb} bandwidth bound connctions – bwShare={bwShare}".format(bwb=bwBound, bwShare=bwUnit(bwShare)))
+
+        for c in storage.connections:
+            demand = storage.demand[c]
+            newShare = 0 if demand == 0 else share.get(c, bwShare)
+            if newShare == storage.share[c] and c not in changed and not c.wantsBwShare(pRun):
+                continue
+            storage.share[c] = newShare
+            c.setAvailableBw(newShare, time, pRun)
+
+            # leaving slowstart raises the desired bandwidth without telling us - takes effect with the next update
+            desiredBw = int(c.getDesiredBw(time, pRun))
+            if desiredBw != demand:
+                self._setDemand(storage, c, desiredBw)
 
 
     def getInfo(self):
@@ -134,7 +157,7 @@ class Interface(object):
 
 
     def __str__(self):
-        storage = self._storageSwitch(self.pRun)
+        storage = self._storageRead(predictionState.pRun)
         conn = [c.getInfo() for c in storage.connections]
         return "{info} connections: {conn}".format(self.getInfo(), conn)
 
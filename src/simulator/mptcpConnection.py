@@ -1,9 +1,7 @@
 """ class to model MPTCP connections """
 
-from enum import Enum
-from copy import copy
-from simulator.eventSimulator import Event, logAdapter, NOPREDICT
-from simulator.connection import Connection, state, connectionCounter
+from simulator.eventSimulator import logAdapter, NOPREDICT, predictionState
+from simulator.connection import Connection, ConnectionEvent, eventKind, state, connectionCounter
 from simulator.tcpConnection import TcpConnection, ssState, BW_TRANSFER_BYTES_ERROR_WARNING_THRESHOLD, EVENT_TRANSFER_BYTES_ERROR_WARNING_THRESHOLD
 from simulator.interface import Interface
 from simulator.globals import bwUnit
@@ -30,17 +28,14 @@ class MptcpConnection(TcpConnection):
         self.origin = origin
         self.id = connectionCounter()
 
-        if pRun == NOPREDICT:
-            self.rStorage = MptcpConnection.ConnectionStorage()
-            self.pStorage = None
-        else:
-            self.rStorage = None
-            self.pStorage = MptcpConnection.ConnectionStorage()
-        self.pRun = pRun
+        self._storageInit(MptcpConnection.ConnectionStorage(), pRun)
 
 
     class ConnectionStorage(TcpConnection.ConnectionStorage):
 
+        # masters do not use ssState and cwnd of the tcp storage
+        __slots__ = ('subflows', 'bwUpdateInProgress')
+
         def __init__(self):
             self.transfers = []
             self.outstandingTransferBytesSum = 0
@@ -56,10 +51,27 @@ class MptcpConnection(TcpConnection):
             self.lastBwUpdateTransferredBytesSum = 0
             self.subflows = []
             self.bwUpdateInProgress = False
+            self.bwUpdatePending = False
+            self.lastTick = 0
+
         def clone(self):
-            clone = copy(self)
+            clone = MptcpConnection.ConnectionStorage.__new__(MptcpConnection.ConnectionStorage)
             clone.transfers = self.transfers[:]
+            clone.outstandingTransferBytesSum = self.outstandingTransferBytesSum
+            clone.transferredBytesSum = self.transferredBytesSum
+            clone.state = self.state
+            clone.mss = self.mss
+            clone.availableBw = self.availableBw
+            clone.desiredBw = self.desiredBw
+            clone.nextEvent = self.nextEvent
+            clone.idleTimestamp = self.idleTimestamp
+            clone.currTransferFinishTime = self.currTransferFinishTime
+            clone.lastBwUpdate = self.lastBwUpdate
+            clone.lastBwUpdateTransferredBytesSum = self.lastBwUpdateTransferredBytesSum
             clone.subflows = self.subflows[:]
+            clone.bwUpdateInProgress = self.bwUpdateInProgress
+            clone.bwUpdatePending = self.bwUpdatePending
+            clone.lastTick = self.lastTick
             return clone
 
 
@@ -69,15 +81,14 @@ class MptcpConnection(TcpConnection):
     #   both will trigger event re-generation through updateDesiredBw as changed
     #   bandwidth needs are the only reason for changed deadlines.
     #   - setAvailableBw for bandwidth-triggered re-calculation of event deadlines
-    class TransferEvent(Event):
-        def __init__(self, connection, time, description):
-            self.conn = connection
-            super().__init__(time, description)
+    class TransferEvent(ConnectionEvent):
 
+        __slots__ = ()
 
         def _handleEvent(self, eventSimulator, time, pRun):
             # get all needed parameters from outer class
             conn = self.conn
+            conn._settle(time, pRun)
             storage = conn._storageSwitch(pRun)
             currTransfer = storage.transfers[0] if storage.transfers else None
 
@@ -166,6 +177,7 @@ class MptcpConnection(TcpConnection):
 
 
     def close(self, time, pRun):
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
         assert storage.state != state.CLOSED
 
@@ -174,7 +186,7 @@ class MptcpConnection(TcpConnection):
             sf.close(time, pRun)
 
         if storage.nextEvent: 
-            storage.nextEvent.disableEvent(pRun)
+            self.eventSimulator.removeEvent(storage.nextEvent, pRun)
         self.eventSimulator.unregisterTickListener(self, pRun)
 
         storage.state = state.CLOSED
@@ -184,6 +196,7 @@ class MptcpConnection(TcpConnection):
     def addTransfer(self, transfer, time, pRun):
         assert transfer.ssl == self.isSSL()
         assert transfer.isEnabled(pRun)
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
 
         # add transfer and update desired bandwidth
@@ -211,6 +224,7 @@ class MptcpConnection(TcpConnection):
 
 
     def updateDesiredBw(self, time, pRun):
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
         newDesiredBw = None
 
@@ -231,6 +245,7 @@ class MptcpConnection(TcpConnection):
         # tell subflows if neccessary
         if newDesiredBw != storage.desiredBw:
             storage.desiredBw = newDesiredBw
+            storage.bwUpdatePending = self.eventSimulator.coalesceUpdates
             storage.bwUpdateInProgress = True
             for sf in storage.subflows:
                 sf.updateDesiredBw(time, pRun)
@@ -239,10 +254,13 @@ class MptcpConnection(TcpConnection):
 
 
     def setAvailableBw(self, availableBw, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
 
-        # only do something if bandwidth changed
-        if storage.availableBw != availableBw:
+        # only do something if bandwidth changed or desired bandwidth changed since
+        if storage.availableBw != availableBw or storage.bwUpdatePending:
+            self._settle(time, pRun)
+            storage = self._storageSwitch(pRun)
+            storage.bwUpdatePending = False
             #logger.debug("updating available bandwidth on MPTCP subflow id={id} – old={old} new={new}".format(id=self.id, old=bwUnit(storage.availableBw), new=bwUnit(availableBw)))
 
             # make sure we got no bandwidth share if we did not ask for one
@@ -261,11 +279,19 @@ class MptcpConnection(TcpConnection):
 
 
     def updateAvailableBw(self, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
 
         if storage.bwUpdateInProgress == True:
             pass
         else:
+            self.eventSimulator.updateAvailableBw(self, time, pRun)
+
+
+    # available bandwidth is the sum of the subflows' bandwidth shares
+    def collectAvailableBw(self, time, pRun):
+        storage = self._storageRead(pRun)
+
+        if storage.state != state.CLOSED:
             newBandwidthSum = 0
             for sf in storage.subflows:
                 newBandwidthSum += sf.getAvailableBw(time, pRun)
@@ -274,18 +300,19 @@ class MptcpConnection(TcpConnection):
 
 
     # re-schedule event if needed
-    def _checkReplaceEvent(self, storage, nextTime, description, pRun):
+    def _checkReplaceEvent(self, storage, nextTime, kind, pRun, *ids):
         assert not storage.nextEvent or type(storage.nextEvent) == MptcpConnection.TransferEvent
 
-        if storage.nextEvent and storage.nextEvent.time == nextTime and storage.nextEvent.description == description:
+        if storage.nextEvent and storage.nextEvent.time == nextTime and storage.nextEvent.isKind(kind, ids):
             return
-        elif storage.nextEvent:
-            storage.nextEvent.disableEvent(pRun)
-            storage.nextEvent = None
 
-        # need a new event
-        storage.nextEvent = MptcpConnection.TransferEvent(self, nextTime, description)
-        self.eventSimulator.addEvent(storage.nextEvent, pRun)
+        # need a new event - re-schedule in place if there is an outstanding one
+        event = MptcpConnection.TransferEvent(self, nextTime, kind, *ids)
+        if storage.nextEvent:
+            self.eventSimulator.replaceEvent(storage.nextEvent, event, pRun)
+        else:
+            self.eventSimulator.addEvent(event, pRun)
+        storage.nextEvent = event
 
 
     def _scheduleNextEvent(self, time, pRun):
@@ -295,14 +322,14 @@ class MptcpConnection(TcpConnection):
 
         # we are idle - calculate timeout
         if storage.state == state.IDLE:
-            self._checkReplaceEvent(storage, storage.idleTimestamp + self.idleTimeout, "tear down idle connection: {conn}".format(conn=self.getInfo(pRun)), pRun)
+            self._checkReplaceEvent(storage, storage.idleTimestamp + self.idleTimeout, eventKind.IDLE_TEARDOWN, pRun, self.id)
         # in mptcp master       
         elif storage.state == state.BUSY and storage.availableBw == 0:
             pass
         elif storage.state == state.BUSY and storage.availableBw > 0:
             transferFinishTime = storage.transfers[0].getOutstandingBytes(pRun) / storage.availableBw
             assert storage.transfers[0].getOutstandingBytes(pRun) == round(storage.availableBw*transferFinishTime)
-            self._checkReplaceEvent(storage, time+transferFinishTime, "transfer finishing in mptcp master", pRun)
+            self._checkReplaceEvent(storage, time+transferFinishTime, eventKind.TRANSFER_FINISH, pRun, self.id, storage.transfers[0].id)
             storage.currTransferFinishTime = time+transferFinishTime
         else:
             assert False
@@ -310,10 +337,11 @@ class MptcpConnection(TcpConnection):
 
     def _tickTime(self, start, end, pRun):
         # stuff info from class
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
 
         # busy connection - transfer data
         if storage.state == state.BUSY:
+            storage = self._storageSwitch(pRun)
             currTransfer = storage.transfers[0]
             #logger.debug(self)
             assert currTransfer.isActive(pRun)
@@ -367,7 +395,7 @@ class MptcpConnection(TcpConnection):
 
 
     def getInfo(self, pRun=None):
-        storage = self._storageSwitch(pRun if pRun else self.pRun)
+        storage = self._storageRead(pRun if pRun is not None else predictionState.pRun)
         return "MPTCP id={id} {origin} {ssl} ({state}/*) togo {trans}T {out}Bytes".format(origin=self.origin,
                                                                                           id=self.id,
                                                                                           ssl="(s)" if self.isSSL() else "",
@@ -377,7 +405,7 @@ class MptcpConnection(TcpConnection):
     
 
     def getSummary(self, pRun=NOPREDICT):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return {'id': self.id,
                 'transferredBytes': storage.transferredBytesSum,
                 'transfers': [t.id for t in storage.transfers],
@@ -394,13 +422,7 @@ class MptcpSubflow(TcpConnection):
         self.interface = interface
         self.eventSimulator = eventSimulator
         self.handshakeDelay = handshakeDelay
-        if pRun == NOPREDICT:
-            self.rStorage = TcpConnection.ConnectionStorage()
-            self.pStorage = None
-        else:
-            self.rStorage = None
-            self.pStorage = TcpConnection.ConnectionStorage()
-        self.pRun = pRun
+        self._storageInit(TcpConnection.ConnectionStorage(), pRun)
         self.id = connectionCounter()
 
 
@@ -428,6 +450,11 @@ class MptcpSubflow(TcpConnection):
         return self.master.isSSL()
 
 
+    # subflows become busy with their master
+    def isQuiescent(self, pRun):
+        return self.master.isIdle(pRun)
+
+
     def addTransfer(self, transfer, time, pRun):
         assert False
 
@@ -438,16 +465,15 @@ class MptcpSubflow(TcpConnection):
     #   both will trigger event re-generation through updateDesiredBw as changed
     #   bandwidth needs are the only reason for changed deadlines.
     #   - setAvailableBw for bandwidth-triggered re-calculation of event deadlines
-    class TransferEvent(Event):
-        def __init__(self, connection, time, description):
-            self.conn = connection
-            super().__init__(time, description)
+    class TransferEvent(ConnectionEvent):
 
+        __slots__ = ()
 
         def _handleEvent(self, eventSimulator, time, pRun):
             # get all needed parameters from outer class
             conn = self.conn
             master = conn.master
+            conn._settle(time, pRun)
             storage = conn._storageSwitch(pRun)
 
             # check event consistency and remove current event from upcoming list
@@ -474,6 +500,7 @@ class MptcpSubflow(TcpConnection):
 
 
     def updateDesiredBw(self, time, pRun):
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
         master = self.master
         newDesiredBw = None
@@ -503,15 +530,19 @@ class MptcpSubflow(TcpConnection):
         # tell interface if neccessary
         if newDesiredBw != storage.desiredBw:
             storage.desiredBw = newDesiredBw
-            self.interface.updateConnectionBwShare(time, pRun)
+            storage.bwUpdatePending = self.eventSimulator.coalesceUpdates
+            self.eventSimulator.updateBwShare(self.interface, self, time, pRun)
 
 
     def setAvailableBw(self, availableBw, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         master = self.master
 
         # only do something if bandwidth changed or if in slowstart
-        if storage.availableBw != availableBw or storage.ssState == ssState.SS:
+        if storage.availableBw != availableBw or storage.ssState == ssState.SS or storage.bwUpdatePending:
+            self._settle(time, pRun)
+            storage = self._storageSwitch(pRun)
+            storage.bwUpdatePending = False
 
             # update local cache
             storage.availableBw = availableBw
@@ -549,16 +580,17 @@ class MptcpSubflow(TcpConnection):
 
 
     # re-schedule event if needed
-    def _checkReplaceEvent(self, storage, nextTime, description, pRun):
-        if storage.nextEvent and storage.nextEvent.time == nextTime and storage.nextEvent.description == description:
+    def _checkReplaceEvent(self, storage, nextTime, kind, pRun, *ids):
+        if storage.nextEvent and storage.nextEvent.time == nextTime and storage.nextEvent.isKind(kind, ids):
             return
-        elif storage.nextEvent:
-            storage.nextEvent.disableEvent(pRun)
-            storage.nextEvent = None
 
-        # need a new event
-        storage.nextEvent = MptcpSubflow.TransferEvent(self, nextTime, description)
-        self.eventSimulator.addEvent(storage.nextEvent, pRun)
+        # need a new event - re-schedule in place if there is an outstanding one
+        event = MptcpSubflow.TransferEvent(self, nextTime, kind, *ids)
+        if storage.nextEvent:
+            self.eventSimulator.replaceEvent(storage.nextEvent, event, pRun)
+        else:
+            self.eventSimulator.addEvent(event, pRun)
+        storage.nextEvent = event
 
 
     def _scheduleNextEvent(self, time, pRun):
@@ -567,18 +599,19 @@ class MptcpSubflow(TcpConnection):
 
         if master.isBusy(pRun) and storage.ssState == ssState.SS:
             rtt = self.interface.getRTT()
-            self._checkReplaceEvent(storage, time+rtt, "slowstart round finishing", pRun)
+            self._checkReplaceEvent(storage, time+rtt, eventKind.SLOWSTART_ROUND, pRun, self.id)
         elif storage.nextEvent:
-            storage.nextEvent.disableEvent(pRun)
+            self.eventSimulator.removeEvent(storage.nextEvent, pRun)
             storage.nextEvent = None
 
 
     def _tickTime(self, start, end, pRun):
         # stuff info from class
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
 
         # busy connection - transfer data
         if storage.state == state.BUSY:
+            storage = self._storageSwitch(pRun)
 
             # calculate how much we will transfer (naïve)
             delta = end - start
@@ -610,7 +643,7 @@ class MptcpSubflow(TcpConnection):
 
 
     def getInfo(self, pRun=None):
-        storage = self._storageSwitch(pRun if pRun else self.pRun)
+        storage = self._storageRead(pRun if pRun is not None else predictionState.pRun)
         return "MPTCP subflow id={id} ({state}/{ssState}) on {iface} for {master}".format(iface=self.interface.getInfo(),
                                                                                           id=self.id,
                                                                                           master=self.master.getInfo(),
@@ -619,7 +652,7 @@ class MptcpSubflow(TcpConnection):
 
 
     def getSummary(self, pRun=NOPREDICT):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return {'id': self.id,
                 'transferredBytes': storage.transferredBytesSum,
                 'interface': self.interface.description}
@@ -27,39 +27,38 @@ class Policy(object):
         return self
 
 
-    def _predictNewConnection(self, transfer, interfaces, transferManager):
+    def _pipelineCandidates(self, transfer, connections):
+        # skip all connections that are on a different host or differ in ssl
+        return [(connection, None) for connection in connections if connection.origin == transfer.origin and connection.ssl == transfer.ssl]
 
-        print('.', end="", file=progressFH)
 
-        # predict the completion time of the given transfer using no existing connection
-        transferTimes = transferManager.predictTransfer(transfer, None, interfaces, DEFAULT_IDLE_TIMEOUT)
-        return {'time': transferTimes['finishTime'], 'conn': None, 'ifaces': interfaces}
-
-
-    def _predictPipelinedConnection(self, transfer, connection, transferManager):
+    def _predictCandidates(self, transfer, candidates, transferManager):
         assert len(transferManager.interfaces) >= 1
 
-        print('.', end="", file=progressFH)
+        print('.' * len(candidates), end="", file=progressFH)
+
+        # predict the completion times of the given transfer for all (connection, interfaces) candidates at once -
+        # we only pick the earliest candidate, so the others may be cut off
+        transferTimes = transferManager.predictCandidates(transfer, candidates, DEFAULT_IDLE_TIMEOUT, tightenBound=True)
+        return [{'time': times['finishTime'], 'conn': connection, 'ifaces': interfaces} for ((connection, interfaces), times) in zip(candidates, transferTimes)]
 
-        # predict the transfer completion time when using an existing connection
-        transferTimes =  transferManager.predictTransfer(transfer, connection, None, DEFAULT_IDLE_TIMEOUT)
-        return {'time': transferTimes['finishTime'], 'conn': connection, 'ifaces': None}
 
+    def _earliest(self, predictions):
+        predictionBest = {'time': float('Inf'), 'conn': None, 'ifaces': None}
 
-    def _predictPipelinedConnections(self, transfer, connections, transferManager):
-        predictionBestPipe = {'time': float('Inf'), 'conn': None, 'ifaces': None}
+        for predictionNew in predictions:
+            if predictionNew['time'] < predictionBest['time']:
+                predictionBest = predictionNew
 
-        for connection in connections:
-            # skip all connections that are on a different host or differ in ssl
-            if connection.origin != transfer.origin or connection.ssl != transfer.ssl:
-                continue
+        return predictionBest
 
-            predictionNew = self._predictPipelinedConnection(transfer, connection, transferManager)
 
-            if predictionNew['time'] < predictionBestPipe['time']:
-                predictionBestPipe = {'time': predictionNew['time'], 'conn': connection, 'ifaces': None}
+    # new connection is predictions[0] and pipelined connections follow - prefer pipelining on ties
+    def _newOrPipelined(self, predictions):
+        predictionNew = predictions[0]
+        predictionPipe = self._earliest(predictions[1:])
 
-        return predictionBestPipe
+        return predictionNew if predictionNew['time'] < predictionPipe['time'] else predictionPipe
 
 
     def predict(self, transfer, transferManager):
@@ -131,11 +130,11 @@ class useOneInterfaceOnly(Policy):
         super().__init__()
         self.interface = interface
 
-    def predict(self, transfer, transferManager):
-        predictionNew = self._predictNewConnection(transfer, [self.interface], transferManager)
-        predictionPipe = self._predictPipelinedConnections(transfer, self.interface.getConnections(), transferManager)
+    def getCandidates(self, transfer):
+        return [(None, [self.interface])] + self._pipelineCandidates(transfer, self.interface.getConnections())
 
-        return predictionNew if predictionNew['time'] < predictionPipe['time'] else predictionPipe
+    def predict(self, transfer, transferManager):
+        return self._newOrPipelined(self._predictCandidates(transfer, self.getCandidates(transfer), transferManager))
 
     def getInfo(self):
         return "{name}({interface})".format(name=self.__class__.__name__, interface=self.interface.description)
@@ -163,14 +162,17 @@ class roundRobin(Policy):
 class earliestArrivalFirst(Policy):
 
     def predict(self, transfer, transferManager):
-        predictionBest = {'time': float('Inf'), 'conn': None, 'ifaces': None}
+        policies = [useOneInterfaceOnly(interface) for interface in transferManager.interfaces]
+        candidates = [policy.getCandidates(transfer) for policy in policies]
 
-        for interface in transferManager.interfaces:
-            predictionNew = useOneInterfaceOnly(interface).predict(transfer, transferManager)
-            if predictionNew['time'] < predictionBest['time']:
-                predictionBest = predictionNew
+        # predict candidates of all interfaces together, then choose per interface
+        predictions = self._predictCandidates(transfer, [c for cs in candidates for c in cs], transferManager)
+        predictionsPerInterface = []
+        for cs in candidates:
+            predictionsPerInterface.append(self._newOrPipelined(predictions[:len(cs)]))
+            predictions = predictions[len(cs):]
 
-        return predictionBest
+        return self._earliest(predictionsPerInterface)
 
 
 class mptcpFullMeshIFListPolicy(Policy):
@@ -181,10 +183,8 @@ class mptcpFullMeshIFListPolicy(Policy):
         
     def predict(self, transfer, transferManager):
 
-        predictionNew = self._predictNewConnection(transfer, self.interfaces , transferManager)
-        predictionPipe = self._predictPipelinedConnections(transfer, transferManager.getConnectionCandidates(), transferManager)
-
-        return predictionNew if predictionNew['time'] < predictionPipe['time'] else predictionPipe
+        candidates = [(None, self.interfaces)] + self._pipelineCandidates(transfer, transferManager.getConnectionCandidates())
+        return self._newOrPipelined(self._predictCandidates(transfer, candidates, transferManager))
 
     def getInfo(self):
         return "{name}({interface})".format(name=self.__class__.__name__, interface="+".join([x.description for x in self.interfaces]))
@@ -192,29 +192,50 @@ class mptcpFullMeshIFListPolicy(Policy):
 class mptcpFullMeshPolicy(Policy):
     def predict(self, transfer, transferManager):
 
-        predictionNew = self._predictNewConnection(transfer, sample(transferManager.interfaces, len(transferManager.interfaces)), transferManager)
-        predictionPipe = self._predictPipelinedConnections(transfer, transferManager.getConnectionCandidates(), transferManager)
-
-        return predictionNew if predictionNew['time'] < predictionPipe['time'] else predictionPipe
+        candidates = [(None, sample(transferManager.interfaces, len(transferManager.interfaces)))] + self._pipelineCandidates(transfer, transferManager.getConnectionCandidates())
+        return self._newOrPipelined(self._predictCandidates(transfer, candidates, transferManager))
 
 
 class earliestArrivalFirstMPTCP(Policy):
     def predict(self, transfer, transferManager):
         # predict new transfer on all existing connections - both single interface and mptcp connections
-        predictionBest = self._predictPipelinedConnections(transfer, transferManager.getConnectionCandidates(), transferManager)
+        candidates = self._pipelineCandidates(transfer, transferManager.getConnectionCandidates())
 
         # new connections - single interface
         for interface in transferManager.interfaces:
-            predictionNew = self._predictNewConnection(transfer, [interface], transferManager)
-            if predictionNew['time'] < predictionBest['time']:
-                predictionBest = predictionNew
+            candidates.append((None, [interface]))
 
         # mptcp combinations
         for i in range(2, len(transferManager.interfaces)+1):
             for interfacecombination in combinations(transferManager.interfaces, i):
                 for interfaces in permutations(interfacecombination):
-                    predictionNew = self._predictNewConnection(transfer, interfaces, transferManager)
-                    if predictionNew['time'] < predictionBest['time']:
-                        predictionBest = predictionNew
-
-        return predictionBest
+                    candidates.append((None, interfaces))
+
+        return self._earliest(self._predictCandidates(transfer, candidates, transferManager))
+
+
+def createPolicy(name, interfaces):
+    """ policy by the name used on the command line
+
+    numbered policies refer to an interface (only1-<n>) or start their list of
+    interfaces at it (rr-<n>, mptcp-<n>), so they work for any number of interfaces.
+    """
+    if name == "eaf":
+        return earliestArrivalFirst()
+    elif name == "mptcp":
+        return mptcpFullMeshPolicy()
+    elif name == "eaf-mptcp":
+        return earliestArrivalFirstMPTCP()
+
+    (base, _, number) = name.rpartition('-')
+    if base in ("only1", "rr", "mptcp") and number.isdigit() and 1 <= int(number) <= len(interfaces):
+        i = int(number) - 1
+        rotated = list(interfaces[i:]) + list(interfaces[:i])
+        if base == "only1":
+            return useOneInterfaceOnly(interfaces[i])
+        elif base == "rr":
+            return roundRobin(rotated)
+        else:
+            return mptcpFullMeshIFListPolicy(rotated)
+
+    raise ValueError("unknown policy: {name}".format(name=name))
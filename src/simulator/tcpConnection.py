@@ -1,10 +1,8 @@
 """ class to model regular TCP connections """
 
-from copy import copy
-from enum import Enum
 from simulator.globals import toMB, bwUnit
-from simulator.eventSimulator import Event, logAdapter, NOPREDICT
-from simulator.connection import Connection, state, connectionCounter 
+from simulator.eventSimulator import logAdapter, NOPREDICT, predictionState
+from simulator.connection import Connection, ConnectionEvent, eventKind, state, connectionCounter
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
 __copyright__ = "Copyright 2017, FG INET, TU Berlin"
@@ -16,7 +14,7 @@ logger = logAdapter.setup("connection")
 BW_TRANSFER_BYTES_ERROR_WARNING_THRESHOLD = 8
 EVENT_TRANSFER_BYTES_ERROR_WARNING_THRESHOLD = 16
 
-class ssState(Enum):
+class ssState(object):
     NEW = 1
     SS = 2
     CA = 3
@@ -35,17 +33,14 @@ class TcpConnection(Connection):
         self.handshakeDelay = self.interface.rtt * (2 if not self.ssl else 4)
         self.id = connectionCounter()
 
-        if pRun == NOPREDICT:
-            self.rStorage = TcpConnection.ConnectionStorage()
-            self.pStorage = None
-        else:
-            self.rStorage = None
-            self.pStorage = TcpConnection.ConnectionStorage()
-        self.pRun = pRun
+        self._storageInit(TcpConnection.ConnectionStorage(), pRun)
 
 
     class ConnectionStorage(object):
 
+        __slots__ = ('transfers', 'outstandingTransferBytesSum', 'transferredBytesSum', 'state', 'ssState', 'mss', 'availableBw', 'desiredBw', 'nextEvent',
+                     'idleTimestamp', 'cwnd', 'currTransferFinishTime', 'lastBwUpdate', 'lastBwUpdateTransferredBytesSum', 'lastTick', 'bwUpdatePending')
+
         def __init__(self):
             self.transfers = []
             self.outstandingTransferBytesSum = 0
@@ -61,37 +56,43 @@ class TcpConnection(Connection):
             self.currTransferFinishTime = None
             self.lastBwUpdate = 0
             self.lastBwUpdateTransferredBytesSum = 0
+            self.lastTick = 0
+            self.bwUpdatePending = False    # desired bandwidth changed since the last bandwidth share
 
 
         def clone(self):
-            clone = copy(self)
+            clone = TcpConnection.ConnectionStorage.__new__(TcpConnection.ConnectionStorage)
             clone.transfers = self.transfers[:]
+            clone.outstandingTransferBytesSum = self.outstandingTransferBytesSum
+            clone.transferredBytesSum = self.transferredBytesSum
+            clone.state = self.state
+            clone.ssState = self.ssState
+            clone.mss = self.mss
+            clone.availableBw = self.availableBw
+            clone.desiredBw = self.desiredBw
+            clone.nextEvent = self.nextEvent
+            clone.idleTimestamp = self.idleTimestamp
+            clone.cwnd = self.cwnd
+            clone.currTransferFinishTime = self.currTransferFinishTime
+            clone.lastBwUpdate = self.lastBwUpdate
+            clone.lastBwUpdateTransferredBytesSum = self.lastBwUpdateTransferredBytesSum
+            clone.lastTick = self.lastTick
+            clone.bwUpdatePending = self.bwUpdatePending
             return clone
 
 
-    def _storageSwitch(self, pRun):
-        if self.pRun != pRun:
-            self.pStorage = self.rStorage.clone()
-            self.pRun = pRun
-
-        if pRun == NOPREDICT:
-            return self.rStorage
-        else:
-            return self.pStorage
-
-
     def isIdle(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.IDLE
 
 
     def isBusy(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.BUSY
 
 
     def isClosed(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.CLOSED
 
 
@@ -99,21 +100,31 @@ class TcpConnection(Connection):
         return self.ssl
 
 
+    # idle and will stay idle unless a transfer is added
+    def isQuiescent(self, pRun):
+        return self.isIdle(pRun)
+
+
+    # every bandwidth share update restarts the current slowstart round
+    def wantsBwShare(self, pRun):
+        storage = self._storageRead(pRun)
+        return storage.ssState == ssState.SS and not self.eventSimulator.skipUnchangedShares
+
+
     # here comes the main state machine split over
     #   - inner class TransferEvent for event triggerd transitons
     #   - connect and add transfers for external triggered transtions
     #   both will trigger event re-generation through updateDesiredBw as changed
     #   bandwidth needs are the only reason for changed deadlines.
     #   - setAvailableBw for bandwidth-triggered re-calculation of event deadlines
-    class TransferEvent(Event):
-        def __init__(self, connection, time, description):
-            self.conn = connection
-            super().__init__(time, description)
+    class TransferEvent(ConnectionEvent):
 
+        __slots__ = ()
 
         def _handleEvent(self, eventSimulator, time, pRun):
             # get all needed parameters from outer class
             conn = self.conn
+            conn._settle(time, pRun)
             storage = conn._storageSwitch(pRun)
             currTransfer = storage.transfers[0] if storage.transfers else None
 
@@ -194,18 +205,19 @@ class TcpConnection(Connection):
         self.eventSimulator.registerTickListener(self, pRun)
 
         # generate slowstart event for connection setup time
-        self._checkReplaceEvent(storage, time + self.handshakeDelay, "handshake delay done on connection id={id}".format(id=self.id), pRun)
+        self._checkReplaceEvent(storage, time + self.handshakeDelay, eventKind.HANDSHAKE_DONE, pRun, self.id)
 
         # notify others
         self._notifyNew(storage, time, pRun)
 
 
     def close(self, time, pRun):
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
         assert storage.state != state.CLOSED
 
         if storage.nextEvent: 
-            storage.nextEvent.disableEvent(pRun)
+            self.eventSimulator.removeEvent(storage.nextEvent, pRun)
         self.eventSimulator.unregisterTickListener(self, pRun)
         self.interface.removeConnection(self, pRun)
 
@@ -216,6 +228,7 @@ class TcpConnection(Connection):
     def addTransfer(self, transfer, time, pRun):
         assert transfer.ssl == self.isSSL()
         assert transfer.isEnabled(pRun)
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
 
         # add transfer and update desired bandwidth
@@ -243,6 +256,7 @@ class TcpConnection(Connection):
 
 
     def updateDesiredBw(self, time, pRun):
+        self._settle(time, pRun)
         storage = self._storageSwitch(pRun)
         newDesiredBw = None
 
@@ -272,14 +286,19 @@ class TcpConnection(Connection):
         # tell interface if neccessary
         if newDesiredBw != storage.desiredBw:
             storage.desiredBw = newDesiredBw
-            self.interface.updateConnectionBwShare(time, pRun)
+            storage.bwUpdatePending = self.eventSimulator.coalesceUpdates
+            self.eventSimulator.updateBwShare(self.interface, self, time, pRun)
 
 
     def setAvailableBw(self, availableBw, time, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
 
         # only do something if bandwidth changed or if in slowstart
-        if storage.availableBw != availableBw or storage.ssState == ssState.SS:
+        # coalesced updates might hide a state change behind an unchanged bandwidth share
+        if storage.availableBw != availableBw or storage.ssState == ssState.SS or storage.bwUpdatePending:
+            self._settle(time, pRun)
+            storage = self._storageSwitch(pRun)
+            storage.bwUpdatePending = False
             # make sure we got no bandwidth share if we did not ask for one
             if storage.state == state.IDLE or storage.ssState == ssState.NEW:
                 assert availableBw == 0
@@ -322,18 +341,19 @@ class TcpConnection(Connection):
 
 
     # re-schedule event if needed
-    def _checkReplaceEvent(self, storage, nextTime, description, pRun):
+    def _checkReplaceEvent(self, storage, nextTime, kind, pRun, *ids):
         assert not storage.nextEvent or type(storage.nextEvent) == TcpConnection.TransferEvent
 
-        if storage.nextEvent and storage.nextEvent.time == nextTime and storage.nextEvent.description == description:
+        if storage.nextEvent and storage.nextEvent.time == nextTime and storage.nextEvent.isKind(kind, ids):
             return
-        elif storage.nextEvent:
-            storage.nextEvent.disableEvent(pRun)
-            storage.nextEvent = None
 
-        # need a new event
-        storage.nextEvent = TcpConnection.TransferEvent(self, nextTime, description)
-        self.eventSimulator.addEvent(storage.nextEvent, pRun)
+        # need a new event - re-schedule in place if there is an outstanding one
+        event = TcpConnection.TransferEvent(self, nextTime, kind, *ids)
+        if storage.nextEvent:
+            self.eventSimulator.replaceEvent(storage.nextEvent, event, pRun)
+        else:
+            self.eventSimulator.addEvent(event, pRun)
+        storage.nextEvent = event
 
 
     def _scheduleNextEvent(self, time, pRun):
@@ -343,7 +363,7 @@ class TcpConnection(Connection):
 
         # we are idle - calculate timeout
         if storage.state == state.IDLE:
-            self._checkReplaceEvent(storage, storage.idleTimestamp + self.idleTimeout, "tear down idle connection: {conn}".format(conn=self.getInfo(pRun)), pRun)
+            self._checkReplaceEvent(storage, storage.idleTimestamp + self.idleTimeout, eventKind.IDLE_TEARDOWN, pRun, self.id)
 
         # still in slowstart - we want to be called next in an rtt or earlier if a transfer finishes earlier
         elif storage.state == state.BUSY and storage.ssState == ssState.SS:
@@ -351,10 +371,10 @@ class TcpConnection(Connection):
             assert storage.transfers[0].getOutstandingBytes(pRun) == round(storage.availableBw*transferFinishTime)
             rtt = self.interface.getRTT()
             if transferFinishTime <= rtt:
-                self._checkReplaceEvent(storage, time+transferFinishTime, "TCP id={id} transfer id={trid} finishing in slowstart".format(id=self.id, trid=storage.transfers[0].id), pRun)
+                self._checkReplaceEvent(storage, time+transferFinishTime, eventKind.TRANSFER_FINISH, pRun, self.id, storage.transfers[0].id)
                 storage.currTransferFinishTime = time+transferFinishTime
             else:
-                self._checkReplaceEvent(storage, time+rtt, "TCP id={id} slowstart round finishing".format(id=self.id), pRun)
+                self._checkReplaceEvent(storage, time+rtt, eventKind.SLOWSTART_ROUND, pRun, self.id)
         # in congestion avoidence        
         elif storage.state == state.BUSY and storage.ssState == ssState.CA:
             if storage.availableBw == 0:
@@ -362,7 +382,7 @@ class TcpConnection(Connection):
                 assert False
             transferFinishTime = storage.transfers[0].getOutstandingBytes(pRun) / storage.availableBw
             assert storage.transfers[0].getOutstandingBytes(pRun) == round(storage.availableBw*transferFinishTime)
-            self._checkReplaceEvent(storage, time+transferFinishTime, "TCP id={id} transfer finishing id={trid} in congestion avoidence".format(id=self.id, trid=storage.transfers[0].id), pRun)
+            self._checkReplaceEvent(storage, time+transferFinishTime, eventKind.TRANSFER_FINISH, pRun, self.id, storage.transfers[0].id)
             storage.currTransferFinishTime = time+transferFinishTime
         else:
             assert False
@@ -370,10 +390,11 @@ class TcpConnection(Connection):
 
     def _tickTime(self, start, end, pRun):
         # stuff info from class
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
 
         # busy connection - transfer data
         if storage.state == state.BUSY:
+            storage = self._storageSwitch(pRun)
             currTransfer = storage.transfers[0]
             #logger.debug(self)
             assert currTransfer.isActive(pRun)
@@ -433,7 +454,7 @@ class TcpConnection(Connection):
 
 
     def getInfo(self, pRun=None):
-        storage = self._storageSwitch(pRun if pRun else self.pRun)
+        storage = self._storageRead(pRun if pRun is not None else predictionState.pRun)
         return "TCP id: {id} {origin} {ssl} ({state}/{ssState}) on {iface} {atrans}to go {trans}T {out}Bytes".format(id=self.id,
                                                                                     origin=self.origin,
                                                                                     ssl="(s)" if self.isSSL() else "",
@@ -450,9 +471,44 @@ class TcpConnection(Connection):
 
 
     def getSummary(self, pRun=NOPREDICT):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return {'id': self.id,
                 'transferredBytes': storage.transferredBytesSum,
                 'transfers': [t.id for t in storage.transfers],
                 'type': 'TCP',
                 'interface': self.interface.description}
+
+
+def predictUncontendedFinishTime(size, interface, ssl, time):
+    """ finish time of a transfer on a new connection that has its interface on its own
+
+    this is the closed form of what the state machine below does in this case:
+    handshake, slowstart rounds with the full interface bandwidth as the only
+    limit and congestion avoidance at full bandwidth once the congestion window
+    exceeds it - using the same integer arithmetic as the simulation. the finish
+    time equals the simulated one up to float rounding of the summed time steps.
+    """
+    rtt = interface.getRTT()
+    bwShare = int(interface.bandwidth)
+    cwnd = TcpConnection.ConnectionStorage().cwnd
+    outstanding = size
+
+    # handshake
+    time += interface.rtt * (2 if not ssl else 4)
+
+    # slowstart rounds
+    while True:
+        desiredBw = int(cwnd / rtt)
+        # dropped out of slowstart - finish in congestion avoidance
+        if desiredBw > bwShare:
+            return time + outstanding / bwShare
+
+        transferFinishTime = outstanding / desiredBw
+        if transferFinishTime <= rtt:
+            return time + transferFinishTime
+
+        end = time + rtt
+        transferBytes = min(int(desiredBw * (end - time)), outstanding)
+        outstanding -= transferBytes
+        cwnd += transferBytes
+        time = end
@@ -1,8 +1,7 @@
 """ class to model transfers and keep their state """
 
 from copy import copy
-from enum import Enum
-from simulator.eventSimulator import logAdapter, NOPREDICT
+from simulator.eventSimulator import logAdapter, NOPREDICT, PredictionStorage, predictionState
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
 __copyright__ = "Copyright 2017, FG INET, TU Berlin"
@@ -18,7 +17,8 @@ def transferCounter():
     transferCounterCounter += 1
     return transferCounterCounter
 
-class state(Enum):
+# plain integers - states are checked on every transfer and connection event
+class state(object):
     NEW = 1
     ENABLED = 2
     ENQUEUED = 3
@@ -26,7 +26,7 @@ class state(Enum):
     FINISHED = 5
 
 
-class Transfer(object):
+class Transfer(PredictionStorage):
 
     def __init__(self, size, origin, ssl, harStartTime=None, harFinishTime=None, objectTimings=None):
         assert size > 0
@@ -40,13 +40,14 @@ class Transfer(object):
         self.harFinishTime = harFinishTime
         self.objectTimings = objectTimings
         self.rStorage = Transfer.TransferStorage(size)
-        self.pStorage = None
-        self.pRun = NOPREDICT
         self.id = transferCounter()
         #logger.debug("created transfer {info}".format(info=self.getInfo()))
 
 
     class TransferStorage(object):
+
+        __slots__ = ('outstandingBytes', 'state', 'startTime', 'enableTime', 'enqueueTime', 'finishTime', 'connection')
+
         def __init__(self, size):
             self.outstandingBytes = size
             self.state = state.NEW
@@ -57,19 +58,23 @@ class Transfer(object):
             self.connection = None
 
         def clone(self):
-            clone = copy(self)
+            clone = Transfer.TransferStorage.__new__(Transfer.TransferStorage)
+            clone.outstandingBytes = self.outstandingBytes
+            clone.state = self.state
+            clone.startTime = self.startTime
+            clone.enableTime = self.enableTime
+            clone.enqueueTime = self.enqueueTime
+            clone.finishTime = self.finishTime
+            clone.connection = self.connection
             return clone
 
 
-    def _storageSwitch(self, pRun):
-        if self.pRun != pRun:
-            self.pStorage = self.rStorage.clone()
-            self.pRun = pRun
-
-        if pRun == NOPREDICT:
-            return self.rStorage
-        else:
-            return self.pStorage
+    def instantiate(self):
+        """ copy for a simulation run - page data is shared, the state is copied and children are linked by the caller """
+        transfer = copy(self)
+        transfer.rStorage = self.rStorage.clone()
+        transfer.children = []
+        return transfer
 
 
     def addChild(self, child):
@@ -77,36 +82,36 @@ class Transfer(object):
 
 
     def isNew(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.NEW
 
 
     def isEnabled(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.ENABLED
 
 
     def isEnqueued(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.ENQUEUED
 
 
     def isActive(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.ACTIVE
 
 
     def isFinished(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.state == state.FINISHED        
 
 
     def getOutstandingBytes(self, pRun):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return storage.outstandingBytes
 
     def getTimes(self, pRun=NOPREDICT):
-        storage = self._storageSwitch(pRun)
+        storage = self._storageRead(pRun)
         return  {'startTime': storage.startTime,
                  'enableTime': storage.enableTime,
                  'enqueueTime': storage.enqueueTime,
@@ -116,7 +121,7 @@ class Transfer(object):
                 
 
     def getConnection(self, pRun=NOPREDICT):
-        return self._storageSwitch(pRun).connection 
+        return self._storageRead(pRun).connection 
 
 
     def transferBytes(self, amount, pRun):
@@ -187,9 +192,9 @@ class Transfer(object):
 
 
     def __str__(self):
-        storage = self._storageSwitch(self.pRun)
+        storage = self._storageRead(predictionState.pRun)
         storageString = "{state} {out}Bytes outstanding, sT {st}s enT {ent}s eqT {eqt}s fT {ft}s".format(state=storage.state, out=storage.outstandingBytes, st=storage.startTime, ent=storage.enableTime, eqt=storage.enqueueTime, ft=storage.finishTime)
-        return "{info} {children} {storage}".format(info=self.getInfo(self.pRun), storage=storageString, children=[c.getInfo() for c in self.children])
+        return "{info} {children} {storage}".format(info=self.getInfo(predictionState.pRun), storage=storageString, children=[c.getInfo() for c in self.children])
 
 
     def getSummary(self):
@@ -0,0 +1,170 @@
+""" columnar state of the transfers of a simulation run
+
+every field of the transfer state is kept in one array indexed by the row of the transfer
+in the transfer manager, children are kept as CSR offsets into one index array. transfers
+keep their API - their real storage becomes a view on a row. prediction runs still clone
+the rows they change into ordinary transfer storages.
+
+numpy is used if it is installed, typed arrays of the standard library otherwise. only
+the numpy columns are vectorized - with typed arrays, reductions like allFinished and
+getFinishTime and reading the times of all transfers are per-row python loops.
+"""
+
+from array import array
+from simulator.transfer import Transfer, state
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+# times that are not set yet are stored as nan
+TIMES = ('startTime', 'enableTime', 'enqueueTime', 'finishTime')
+UNSET = float('nan')
+
+
+def _column(typecode, values):
+    if numpy is not None:
+        return numpy.array(values, dtype={'q': numpy.int64, 'b': numpy.int8, 'd': numpy.float64}[typecode])
+    return array(typecode, values)
+
+
+def _time(value):
+    return None if value != value else float(value)
+
+
+class TransferColumns(object):
+
+    def __init__(self, transfers):
+        """ take over the real state of transfers - their storages become views on the columns """
+        self.rows = {t: row for (row, t) in enumerate(transfers)}
+
+        storages = [t.rStorage for t in transfers]
+        self.outstandingBytes = _column('q', [s.outstandingBytes for s in storages])
+        self.state = _column('b', [s.state for s in storages])
+        for name in TIMES:
+            setattr(self, name, _column('d', [UNSET if getattr(s, name) is None else getattr(s, name) for s in storages]))
+        # connections are objects - they stay in a list
+        self.connection = [s.connection for s in storages]
+
+        self.childOffsets = _column('q', [0] * (len(transfers) + 1))
+        children = []
+        for (row, t) in enumerate(transfers):
+            children.extend(self.rows[c] for c in t.children)
+            self.childOffsets[row + 1] = len(children)
+        self.children = _column('q', children)
+
+        for (row, t) in enumerate(transfers):
+            t.rStorage = ColumnStorage(self, row)
+
+
+    def getChildren(self, row):
+        """ rows of the children of a row """
+        return self.children[self.childOffsets[row]:self.childOffsets[row + 1]]
+
+
+    def allFinished(self):
+        if numpy is not None:
+            return bool((self.state == state.FINISHED).all())
+        return all(code == state.FINISHED for code in self.state)
+
+
+    def getFinishTime(self):
+        """ time the last transfer finished - the page load time of a finished run """
+        if numpy is not None:
+            return _time(numpy.nanmax(self.finishTime)) if not numpy.isnan(self.finishTime).all() else None
+        times = [t for t in self.finishTime if t == t]
+        return max(times) if times else None
+
+
+    def getTimes(self):
+        """ all times of all transfers - lists indexed by row, None for times that are not set """
+        return {name: [_time(t) for t in getattr(self, name)] for name in TIMES}
+
+
+    def getSummaries(self, transfers):
+        """ getSummary() of all transfers - times are read column by column """
+        times = self.getTimes()
+        ids = [t.id for t in transfers]
+        return [{'id': t.id,
+                 'origin': t.origin,
+                 'ssl': t.ssl,
+                 'size': t.size,
+                 'children': [ids[c] for c in self.getChildren(row)],
+                 'times': {'startTime': times['startTime'][row],
+                           'enableTime': times['enableTime'][row],
+                           'enqueueTime': times['enqueueTime'][row],
+                           'finishTime': times['finishTime'][row],
+                           'harStartTime': t.harStartTime,
+                           'harFinishTime': t.harFinishTime}}
+                for (row, t) in enumerate(transfers)]
+
+
+
+class ColumnStorage(object):
+    """ real storage of a transfer - a view on its row of the transfer columns """
+
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+
+    def _getOutstandingBytes(self):
+        return int(self.columns.outstandingBytes[self.row])
+
+    def _setOutstandingBytes(self, value):
+        self.columns.outstandingBytes[self.row] = value
+
+    outstandingBytes = property(_getOutstandingBytes, _setOutstandingBytes)
+
+
+    def _getState(self):
+        return int(self.columns.state[self.row])
+
+    def _setState(self, value):
+        self.columns.state[self.row] = value
+
+    state = property(_getState, _setState)
+
+
+    def _getConnection(self):
+        return self.columns.connection[self.row]
+
+    def _setConnection(self, value):
+        self.columns.connection[self.row] = value
+
+    connection = property(_getConnection, _setConnection)
+
+
+    def _timeProperty(name):
+        def getTime(self):
+            return _time(getattr(self.columns, name)[self.row])
+
+        def setTime(self, value):
+            getattr(self.columns, name)[self.row] = UNSET if value is None else value
+
+        return property(getTime, setTime)
+
+    startTime = _timeProperty('startTime')
+    enableTime = _timeProperty('enableTime')
+    enqueueTime = _timeProperty('enqueueTime')
+    finishTime = _timeProperty('finishTime')
+
+
+    def clone(self):
+        # prediction runs work on ordinary storages
+        clone = Transfer.TransferStorage(self.outstandingBytes)
+        clone.state = self.state
+        clone.startTime = self.startTime
+        clone.enableTime = self.enableTime
+        clone.enqueueTime = self.enqueueTime
+        clone.finishTime = self.finishTime
+        clone.connection = self.connection
+        return clone
@@ -2,11 +2,13 @@
 
 import logging
 import json
-from copy import deepcopy
-from simulator.eventSimulator import EventSimulator, logAdapter, NOPREDICT
-from simulator.tcpConnection import TcpConnection
+from copy import copy
+from simulator.eventSimulator import EventSimulator, BatchListener, logAdapter, NOPREDICT, DEFAULT_ENGINE
+from simulator.eventQueue import DEFAULT_EVENT_QUEUE
+from simulator.tcpConnection import TcpConnection, predictUncontendedFinishTime
 from simulator.mptcpConnection import MptcpConnection
 from simulator.connection import Connection
+from simulator.transferColumns import TransferColumns
 
 __author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
 __copyright__ = "Copyright 2017, FG INET, TU Berlin"
@@ -15,7 +17,26 @@ __license__ = "RELAXED CRAPL v0 BETA 1"
 
 logger = logAdapter.setup("transferManager")
 
-class TransferManager(object):
+# analytic and simulated predictions only differ by float rounding (up to 15us seen on synthetic pages) -
+# maximum difference accepted in validation mode
+ANALYTIC_PREDICTION_TOLERANCE = 0.0001
+
+# short keys of compact json dumps
+COMPACT_KEYS = {'name': 'n', 'description': 'd', 'bandwidth': 'bw', 'rtt': 'rtt',
+                'id': 'id', 'type': 'ty', 'interface': 'if', 'subflows': 'sf', 'transferredBytes': 'tb', 'transfers': 't',
+                'origin': 'o', 'ssl': 's', 'size': 'b', 'children': 'c', 'times': 'tm',
+                'startTime': 'st', 'enableTime': 'et', 'enqueueTime': 'qt', 'finishTime': 'ft', 'harStartTime': 'hs', 'harFinishTime': 'hf'}
+
+
+def _compactKeys(value):
+    if isinstance(value, dict):
+        return {COMPACT_KEYS.get(k, k): _compactKeys(v) for (k, v) in value.items()}
+    if isinstance(value, list):
+        return [_compactKeys(v) for v in value]
+    return value
+
+
+class TransferManager(BatchListener):
 
     def __init__(self):
         self.policy = None
@@ -32,6 +53,9 @@ class TransferManager(object):
 
         self.interfaces = []
 
+        # columnar state of the transfers of a run - None if every transfer keeps its own storage
+        self.columns = None
+
         self.connections = []
 
         self.busyConnections = set()
@@ -41,6 +65,18 @@ class TransferManager(object):
 
         self.pRun = NOPREDICT
         self.pTransfer = None
+        self.pTransferTimes = None
+
+        # predict new connections on uncontended interfaces without simulation
+        self.useAnalyticPredictions = True
+        self.validateAnalyticPredictions = False
+        self.analyticPredictions = 0
+        self.analyticPredictionMismatches = 0
+
+        # duplicate candidates of a decision share one prediction run
+        self.sharedPredictions = 0
+        self.simulatedPredictions = 0
+        self.predictionCutoffs = 0
 
 
 
@@ -53,7 +89,7 @@ class TransferManager(object):
             self.idleConnections.add(connection)
             # notify policy that there might be transfers to schedule
             if self.policy:
-                self.policy.notify(self, time)
+                self.eventSimulator.settleAfterBatch(self, time, pRun)
 
 
     def busiedConnection(self, connection, time, pRun):
@@ -105,6 +141,39 @@ class TransferManager(object):
             return set()
 
 
+    def instantiate(self, columnar=False):
+        """ transfer manager for a simulation run on the transfers of this template - the template is not changed
+
+        transfers share the page data with the template and only get their own state, so a run
+        starts in time linear in the number of transfers instead of deep copying the object graph.
+        with columnar, the state of all transfers is kept in TransferColumns
+        """
+        assert not (self.enqueuedTransfers or self.activeTransfers or self.finishedTransfers or self.connections)
+        assert not self.columns
+
+        tm = copy(self)
+        instances = {t: t.instantiate() for t in self.transfers}
+        for (t, instance) in instances.items():
+            instance.children = [instances[c] for c in t.children]
+
+        tm.transfers = [instances[t] for t in self.transfers]
+        tm.newTransfers = [instances[t] for t in self.newTransfers]
+        tm.enabledTransfers = [instances[t] for t in self.enabledTransfers]
+        tm.enqueuedTransfers = []
+        tm.activeTransfers = []
+        tm.finishedTransfers = []
+
+        tm.connections = []
+        tm.busyConnections = set()
+        tm.idleConnections = set()
+        tm.closedConnections = set()
+        tm.connectionOrigin = {}
+
+        if columnar:
+            tm.columns = TransferColumns(tm.transfers)
+        return tm
+
+
     def addTransfer(self, transfer):
         assert transfer.isNew(NOPREDICT)
 
@@ -136,6 +205,12 @@ class TransferManager(object):
 
         # notify policy that there might be transfers to schedule
         if self.eventSimulator and self.policy:
+            self.eventSimulator.settleAfterBatch(self, time, pRun)
+
+
+    # the policy is told once per timestamp after bandwidth shares are settled
+    def _settleBatch(self, time, pRun):
+        if pRun == NOPREDICT:
             self.policy.notify(self, time)
 
 
@@ -177,8 +252,9 @@ class TransferManager(object):
                 self.finishTime = time
 
 
-        # finsh pRun if transfer we are looking at finfishes
+        # finsh pRun if transfer we are looking at finfishes - keep its times as prediction state is dropped
         elif transfer == self.pTransfer:
+            self.pTransferTimes = transfer.getTimes(pRun)
             self.eventSimulator.endPrecition(pRun)
 
 
@@ -215,27 +291,140 @@ class TransferManager(object):
         self._scheduleTransfer(transfer, connection, interfaces, idleTimeout, NOPREDICT)
 
 
-    def predictTransfer(self, transfer, connection, interfaces, idleTimeout):
+    def getPredictionStats(self):
+        return {'shared': self.sharedPredictions,
+                'simulated': self.simulatedPredictions}
+
+
+    def getAnalyticPredictionStats(self):
+        return {'predictions': self.analyticPredictions,
+                'mismatches': self.analyticPredictionMismatches}
+
+
+    # analytic prediction equals the simulation up to float rounding for new TCP connections on interfaces
+    # no other connection is going to use
+    def _isAnalyticCandidate(self, connection, interfaces):
+        if connection or len(interfaces) != 1 or not interfaces[0].isUncontended(NOPREDICT):
+            return False
+
+        # busy MPTCP connections add their subflows on further interfaces after the handshake
+        for c in self.busyConnections:
+            if isinstance(c, MptcpConnection) and interfaces[0] in c.interfaces:
+                return False
+        return True
+
+
+    def _predictTransferAnalytic(self, transfer, interface):
+        time = self.eventSimulator.getTime(NOPREDICT)
+        times = transfer.getTimes(NOPREDICT)
+        times['startTime'] = time
+        times['finishTime'] = predictUncontendedFinishTime(transfer.getOutstandingBytes(NOPREDICT), interface, transfer.ssl, time)
+        return times
+
+
+    def _validateAnalyticPrediction(self, times, transfer, interfaces, idleTimeout):
+        simulatedTimes = self._predictTransfer(transfer, None, interfaces, idleTimeout)
+        if abs(simulatedTimes['finishTime'] - times['finishTime']) > ANALYTIC_PREDICTION_TOLERANCE:
+            logger.warning("analytic prediction for transfer {trans} on {iface} off by {delta:.6f}s".format(trans=transfer.getInfo(), iface=interfaces[0].getInfo(), delta=times['finishTime'] - simulatedTimes['finishTime']))
+            self.analyticPredictionMismatches += 1
+
+
+    def predictTransfer(self, transfer, connection, interfaces, idleTimeout, bound=float('Inf')):
+        return self.predictCandidates(transfer, [(connection, interfaces)], idleTimeout, bound)[0]
+
+
+    def predictCandidates(self, transfer, candidates, idleTimeout, bound=float('Inf'), tightenBound=False):
+        """ predict the transfer times of transfer for a list of (connection, interfaces) candidates
+
+        all candidates of one scheduling decision are evaluated against the same
+        real state, so the interfaces are checked for contention only once.
+        duplicate and analytic candidates do not fork a prediction run. returns
+        the transfer times in candidate order.
+
+        prediction runs are cut off once they pass bound and report a finishTime
+        of Inf and boundExceeded. with tightenBound, the bound is lowered to the
+        earliest finish time seen so far, so only candidates that can not be the
+        earliest (or tie with it) are cut off.
+        """
+
+        # results of duplicate candidates - every decision is followed by a change of the
+        # real state, so predictions are not kept beyond it
+        cache = {}
+
+        # first pass - answer analytic candidates
+        uncontended = {}
+        results = [None] * len(candidates)
+        for (n, (connection, interfaces)) in enumerate(candidates):
+
+            if self.useAnalyticPredictions and not connection and len(interfaces) == 1:
+                interface = interfaces[0]
+                if interface not in uncontended:
+                    uncontended[interface] = self._isAnalyticCandidate(connection, interfaces)
+                if uncontended[interface]:
+                    times = self._predictTransferAnalytic(transfer, interface)
+                    self.analyticPredictions += 1
+                    if self.validateAnalyticPredictions:
+                        self._validateAnalyticPrediction(times, transfer, interfaces, idleTimeout)
+                    results[n] = times
+
+            # analytic times may be off by float rounding - do not cut off candidates that tie with them
+            if tightenBound and results[n] is not None:
+                bound = min(bound, results[n]['finishTime'] + ANALYTIC_PREDICTION_TOLERANCE)
+
+        # second pass - simulate the rest
+        for (n, (connection, interfaces)) in enumerate(candidates):
+            if results[n] is not None:
+                continue
+
+            # cut off predictions are only valid for lower bounds
+            key = self._predictionKey(transfer, connection, interfaces, idleTimeout)
+            (times, timesBound) = cache.get(key, (None, None))
+            if times is not None and timesBound >= bound:
+                self.sharedPredictions += 1
+            else:
+                self.simulatedPredictions += 1
+                times = self._predictTransfer(transfer, connection, interfaces, idleTimeout, bound)
+                cache[key] = (times, bound if times.get('boundExceeded') else float('Inf'))
+            results[n] = dict(times)
+
+            if tightenBound:
+                bound = min(bound, times['finishTime'])
+
+        return results
+
+
+    def _predictionKey(self, transfer, connection, interfaces, idleTimeout):
+        return (transfer, connection, tuple(interfaces) if interfaces else None, idleTimeout)
+
+
+    def _predictTransfer(self, transfer, connection, interfaces, idleTimeout, bound=float('Inf')):
 
         pRun = self.eventSimulator.beginPrediction()
         self.pRun = pRun
         self.pTransfer = transfer
         #logger.debug("stating prediction of {0} on {1}".format(transfer.getInfo(), [i.getInfo() for i in interfaces] if interfaces else connection.getInfo() ))
         self._scheduleTransfer(transfer, connection, interfaces, idleTimeout, pRun)
-        self.eventSimulator.predictionRun(pRun)
+        finished = self.eventSimulator.predictionRun(pRun, bound)
 
         self.pRun = NOPREDICT
         #logger.debug("finished prediction of {0} on {1}".format(transfer.getInfo(), [i.getInfo() for i in interfaces] if interfaces else connection.getInfo()))
 
-        return transfer.getTimes(pRun)
+        if not finished:
+            self.predictionCutoffs += 1
+            times = transfer.getTimes(NOPREDICT)
+            times['finishTime'] = float('Inf')
+            times['boundExceeded'] = True
+            return times
+
+        return self.pTransferTimes
 
 
-    def runTransfers(self, interfaces, policy):
+    def runTransfers(self, interfaces, policy, eventQueue=DEFAULT_EVENT_QUEUE, engine=DEFAULT_ENGINE, coalesceUpdates=True, columnar=False, skipUnchangedShares=False):
 
-        # copy template transfer manager and prepare simulation
-        tm = deepcopy(self)
-        tm.eventSimulator = EventSimulator()
-        tm.interfaces = deepcopy(interfaces)
+        # instantiate template transfer manager and prepare simulation
+        tm = self.instantiate(columnar)
+        tm.eventSimulator = EventSimulator(eventQueue, engine, coalesceUpdates, skipUnchangedShares)
+        tm.interfaces = [i.instantiate() for i in interfaces]
         tm.policy = policy.prepare(tm)
         assert tm.policy
 
@@ -249,19 +438,51 @@ class TransferManager(object):
 
         #logger.debug("finished simulation")
 
-        # check whether all transfers are finished
-        for transfer in tm.transfers:
-            if not transfer.isFinished(NOPREDICT):
-                logger.error("transfer: {trans} not finished".format(trans=transfer.getInfo()))
-            assert transfer.isFinished(NOPREDICT)
+        # check whether all transfers are finished - the columns can tell at once
+        if not (tm.columns and tm.columns.allFinished()):
+            for transfer in tm.transfers:
+                if not transfer.isFinished(NOPREDICT):
+                    logger.error("transfer: {trans} not finished".format(trans=transfer.getInfo()))
+                assert transfer.isFinished(NOPREDICT)
 
+        # the page load time is the latest finish time - a single reduction over the column
+        if tm.columns:
+            return tm, tm.columns.getFinishTime()
         return tm, tm.finishTime
 
 
-    def dumpJson(self, fh):
-        json.dump({
-            'policy':       self.policy.getSummary(),
-            'interfaces':   [i.getSummary() for i in self.interfaces],
-            'connections':  [i.getSummary() for i in self.connections],
-            'transfers' :   [t.getSummary() for t in self.transfers]
-            }, fh, indent="\t")
+    def dumpJson(self, fh, compact=False):
+        """ write policy, interfaces, connections and transfers of a finished run as json - one record at a time
+
+        the default output equals json.dump() of all summaries with tab indentation. compact output
+        has no whitespace and short keys - it starts with the mapping of the short keys ("keys")
+        """
+        sections = [('policy',      self.policy.getSummary()),
+                    ('interfaces',  (i.getSummary() for i in self.interfaces)),
+                    ('connections', (c.getSummary() for c in self.connections)),
+                    ('transfers',   self.columns.getSummaries(self.transfers) if self.columns else (t.getSummary() for t in self.transfers))]
+
+        if compact:
+            sections = [('keys', {short: key for (key, short) in COMPACT_KEYS.items()})] + \
+                       [(name, _compactKeys(value) if isinstance(value, dict) else map(_compactKeys, value)) for (name, value) in sections]
+            dumpRecord = lambda record, depth: json.dumps(record, separators=(',', ':'))
+            (newline, indent, colon) = ("", "", ":")
+        else:
+            # json escapes newlines in strings - every newline is part of the indentation
+            dumpRecord = lambda record, depth: json.dumps(record, indent="\t").replace("\n", "\n" + "\t" * depth)
+            (newline, indent, colon) = ("\n", "\t", ": ")
+
+        fh.write("{")
+        for (n, (name, value)) in enumerate(sections):
+            fh.write("{sep}{nl}{indent}{name}{colon}".format(sep="," if n else "", nl=newline, indent=indent, name=json.dumps(name), colon=colon))
+            if isinstance(value, dict):
+                fh.write(dumpRecord(value, 1))
+                continue
+
+            fh.write("[")
+            empty = True
+            for record in value:
+                fh.write("{sep}{nl}{indent}{record}".format(sep="" if empty else ",", nl=newline, indent=indent * 2, record=dumpRecord(record, 2)))
+                empty = False
+            fh.write("]" if empty else newline + indent + "]")
+        fh.write(newline + "}")
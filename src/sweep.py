@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+""" run a whole parameter grid on .har files in a single process or a process pool
+
+usage: sweep.py [-j <processes>] [-s <grid spec>] [-o <result-db> [-t]] [-d <dump dir>] <har-file> [<har-file> ...]
+
+every .har file is parsed once and every grid point is simulated from that template.
+one result line per simulator run is printed to sys.stdout in grid order, using the
+columns of mainSingle.py - log and progress are printed to sys.stderr. with -o, runs
+are written to one result store instead (see results.py), with -t including the times
+of every transfer. runs that are already in the store (with -t: with transfer times) are
+not simulated again. with -d, the details of every run are dumped as compact, compressed
+json (<har-file>.<run>.sim.json.gz).
+
+the grid spec is a json file listing the values per interface and the policies to run:
+    {"interfaces": [{"bandwidth": ["500k", "2m"], "rtt": [10, 20]},
+                    {"bandwidth": ["5m"], "rtt": [50, 100]}],
+     "policies": ["only1-1", "eaf", "mptcp-1"]}
+bandwidths are given in kbit (k) or mbit (m), rtts in milliseconds. without a spec,
+the grid of scripts/generateTasks.py is used.
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from itertools import chain, product
+
+from simulator.globals import mbit, kbit, ms, progressFH, SIMULATOR_VERSION
+from simulator.transferManager import TransferManager
+from simulator.interface import Interface
+from simulator.policy import createPolicy
+from simulator.eventSimulator import setupLogging
+from workload import readPage, workloadHash
+from results import ResultWriter, storedKeys, transferTimes
+
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+logger = logging.getLogger("sweep")
+
+# same grid as scripts/generateTasks.py
+DEFAULT_SPEC = {
+    'interfaces': [{'bandwidth': ["500k", "2m", "6m", "12m", "20m", "50m"], 'rtt': [10, 20, 30, 50]},
+                   {'bandwidth': ["500k", "5m", "20m", "50m"],             'rtt': [20, 50, 100, 200]}],
+    'policies':   ["only1-1", "only1-2", "rr-1", "eaf", "mptcp", "mptcp-1", "eaf-mptcp"]
+}
+
+# chunks per worker process - small chunks balance large pages against small ones
+CHUNKS_PER_PROCESS = 8
+
+
+def parseBandwidth(bw):
+    value = float(bw[:-1])
+    if bw[-1] == 'm':
+        return mbit(value)
+    elif bw[-1] == 'k':
+        return kbit(value)
+    raise ValueError("bandwidth needs a unit (k or m): {bw}".format(bw=bw))
+
+
+def gridPoints(spec):
+    """ all (bandwidths, rtts, policy) of the grid - in the order of scripts/generateTasks.py """
+    bandwidths = [[parseBandwidth(bw) for bw in i['bandwidth']] for i in spec['interfaces']]
+    rtts = [[ms(rtt) for rtt in i['rtt']] for i in spec['interfaces']]
+
+    for bws in product(*bandwidths):
+        for rs in product(*rtts):
+            for policy in spec['policies']:
+                yield (bws, rs, policy)
+
+
+def createInterfaces(bws, rtts):
+    return [Interface(rtt=rtt, bandwidth=bw, description="if{n}".format(n=n+1)) for (n, (bw, rtt)) in enumerate(zip(bws, rtts))]
+
+
+def runKey(pageHash, point):
+    """ key of the result of a run - sha1 (hex) of simulator version, workload hash, interface parameters and policy """
+    (bws, rtts, policyName) = point
+    # the info of a policy names its interfaces, i.e. its arguments
+    policy = createPolicy(policyName, createInterfaces(bws, rtts)).getInfo()
+    return hashlib.sha1(json.dumps([SIMULATOR_VERSION, pageHash, bws, rtts, policy]).encode('utf-8')).hexdigest()
+
+
+def runPoint(transferManager, point, transfers=False, dumpFileName=None):
+    """ simulate one grid point on the transfers of transferManager - returns a summary of the run
+
+    every run gets fresh interfaces and a fresh policy, just like a separate mainSingle.py process.
+    with transfers, the summary includes the times of every transfer. with dumpFileName, the
+    details of the run are dumped there
+    """
+    (bws, rtts, policyName) = point
+    interfaces = createInterfaces(bws, rtts)
+    policy = createPolicy(policyName, interfaces)
+    (result, time) = transferManager.runTransfers(interfaces, policy)
+
+    run = {'policy':     policy.getInfo(),
+           'interfaces': [i.getSummary() for i in interfaces],
+           'time':       time}
+    if transfers:
+        run['transfers'] = transferTimes(result)
+    if dumpFileName:
+        with gzip.open(dumpFileName, 'wt', compresslevel=6) as fh:
+            result.dumpJson(fh, compact=True)
+    return run
+
+
+# templates of a worker process - inherited when forked, pickled once per worker otherwise
+workerPages = None
+
+def _initWorker(pages):
+    global workerPages
+    workerPages = pages
+
+
+def _runWork(pages, work):
+    (page, point, transfers, dumpFileName, key) = work
+    run = runPoint(pages[page], point, transfers, dumpFileName)
+    if key:
+        run['key'] = key
+    return (page, run)
+
+
+def _runWorkerPoint(work):
+    return _runWork(workerPages, work)
+
+
+def sweep(pages, spec, processes=1, chunksize=None, transfers=False, dumpPrefixes=None, done=None):
+    """ run the grid on all pages (transfer manager templates) - yields (page index, run summary) in grid order
+
+    with more than one process, grid points of all pages are spread over a process pool in chunks.
+    with dumpPrefixes (one per page), every run is dumped to <prefix>.<run>.sim.json.gz. with done
+    (a set of run keys, see runKey), runs get their key and runs in done are skipped
+    """
+    work = []
+    skipped = 0
+    for page in range(len(pages)):
+        pageHash = workloadHash(pages[page]) if done is not None else None
+        for (n, point) in enumerate(gridPoints(spec)):
+            key = runKey(pageHash, point) if done is not None else None
+            if key and key in done:
+                skipped += 1
+                continue
+            work.append((page, point, transfers, "{p}.{n:05d}.sim.json.gz".format(p=dumpPrefixes[page], n=n) if dumpPrefixes else None, key))
+    if skipped:
+        logger.info("skipping {s} runs with stored results - {w} runs left".format(s=skipped, w=len(work)))
+
+    if processes == 1 or not work:
+        for w in work:
+            yield _runWork(pages, w)
+        return
+
+    # fork shares the parsed pages copy-on-write - other start methods pickle them once per worker
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    if not chunksize:
+        chunksize = max(1, len(work) // (processes * CHUNKS_PER_PROCESS))
+    with context.Pool(processes, initializer=_initWorker, initargs=(pages,)) as pool:
+        yield from pool.imap(_runWorkerPoint, work, chunksize)
+
+
+def resultRow(origin, infileDate, infileTime, run):
+    #"website", "crawl", "time", "policy", "if1_bw", "if1_rtt", ... "time"
+    return ",".join(map(lambda s: str(s), [origin, infileDate, infileTime, run['policy']] + list(chain.from_iterable(map(lambda i: [i['bandwidth'], i['rtt']], run['interfaces']))) + [run['time']]))
+
+
+def writeResults(runs, pageInfo, fileName=None):
+    """ print (page index, run summary) of runs as result lines or write them to the result store fileName
+
+    pageInfo holds (origin, crawl, crawl time) per page. runs finished before runs raises are still stored
+    """
+    writer = ResultWriter(fileName) if fileName else None
+    try:
+        for (page, run) in runs:
+            print('\n{h:<16s}{p} {t:3.3f}s'.format(h="result:", p=run['policy'], t=run['time']), file=progressFH, flush=True)
+            if writer:
+                writer.add(*pageInfo[page], run)
+            else:
+                print(resultRow(*pageInfo[page], run), flush=True)
+    finally:
+        if writer:
+            writer.close()
+
+
+if __name__ == "__main__":
+    setupLogging(fast=True)
+
+    parser = argparse.ArgumentParser(description="run a parameter grid on .har files")
+    parser.add_argument('-j', '--processes', type=int, default=1, help="number of worker processes - 0 uses all cores")
+    parser.add_argument('-s', '--spec', help="grid spec (json) - defaults to the grid of generateTasks.py")
+    parser.add_argument('-o', '--output', help="result store (sqlite) to write the runs to instead of printing them")
+    parser.add_argument('-t', '--transfers', action='store_true', help="write the times of every transfer to the result store")
+    parser.add_argument('-d', '--dump', metavar='DIR', help="dump the details of every run to DIR")
+    parser.add_argument('harFiles', nargs='+', metavar='har-file')
+    args = parser.parse_args()
+
+    spec = DEFAULT_SPEC
+    if args.spec:
+        with open(args.spec) as fh:
+            spec = json.load(fh)
+
+    pages = []
+    pageInfo = []
+    for ifileName in args.harFiles:
+        (infileSite, infileDate, infileTime) = os.path.basename(ifileName)[:-4].split('+')
+        transferManager = TransferManager()
+        origin = readPage(ifileName, transferManager)
+        pages.append(transferManager)
+        pageInfo.append((origin, infileDate, infileTime))
+
+    if args.transfers and not args.output:
+        parser.error("-t needs a result store (-o)")
+
+    # runs already in the result store are skipped
+    done = storedKeys(args.output, args.transfers) if args.output else None
+    dumpPrefixes = [os.path.join(args.dump, os.path.basename(f)[:-4]) for f in args.harFiles] if args.dump else None
+    writeResults(sweep(pages, spec, args.processes or os.cpu_count(), transfers=args.transfers, dumpPrefixes=dumpPrefixes, done=done), pageInfo, args.output)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+""" compact binary workload files - parsed .har pages ready to be loaded into a transfer manager
+
+usage: workload.py [-j <processes>] [-f] [--verification] <har-file or directory> [...]
+
+converts .har files into workload files next to them - directories are searched for .har
+files recursively and converted by a pool of worker processes. readPage() uses a workload
+file instead of parsing the .har file whenever it is present and up to date.
+
+a workload file holds exactly what the simulator needs from a page:
+    header          magic, version, flags, sha1/size/mtime of the .har file and table sizes
+    transfers       fixed-width records in the order transfers are added to the transfer manager
+    children        child indices of all transfers - each record points to its slice (CSR)
+    origins         string table of origins - offsets followed by utf-8 data
+"""
+
+import sys, os
+import argparse
+import multiprocessing
+import struct
+import mmap
+import hashlib
+import logging
+from array import array
+
+from simulator.transfer import Transfer
+from simulator.transferManager import TransferManager
+from simulator.eventSimulator import setupLogging
+from harParser import HarParser
+
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+logger = logging.getLogger("workload")
+
+WORKLOAD_MAGIC = b'DTSW'
+WORKLOAD_VERSION = 1
+WORKLOAD_SUFFIX = ".dtw"
+
+# flags
+VERIFICATION = 0x1
+
+# magic, version, flags, sha1, har size, har mtime, transfers, children, origins, origin bytes
+HEADER = struct.Struct('<4sHH20sQdIIII')
+# size, har start/finish time, timings (connect, receive, wait, blocked, dns, send), origin, first child, children, ssl, enabled
+RECORD = struct.Struct('<q8dIIIBB')
+TIMINGS = ('connect', 'receive', 'wait', 'blocked', 'dns', 'send')
+UNSET = float('nan')
+
+
+def workloadFileName(harFileName, verification=False):
+    return "{har}{v}{suffix}".format(har=harFileName, v=".verification" if verification else "", suffix=WORKLOAD_SUFFIX)
+
+
+def _sha1(fileName):
+    h = hashlib.sha1()
+    with open(fileName, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.digest()
+
+
+def _readHeader(fh):
+    data = fh.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError("truncated workload file")
+    header = HEADER.unpack(data)
+    if header[0] != WORKLOAD_MAGIC or header[1] != WORKLOAD_VERSION:
+        raise ValueError("not a workload file of version {v}".format(v=WORKLOAD_VERSION))
+    return header
+
+
+def isCurrent(fileName, harFileName, verification=False):
+    """ true if the workload file was converted from the current content of the .har file """
+    try:
+        with open(fileName, 'rb') as fh:
+            (_, _, flags, sha1, harSize, harMtime, _, _, _, _) = _readHeader(fh)
+        stat = os.stat(harFileName)
+    except (OSError, ValueError):
+        return False
+
+    if bool(flags & VERIFICATION) != verification or stat.st_size != harSize:
+        return False
+    # touched files might still have the same content
+    return stat.st_mtime == harMtime or _sha1(harFileName) == sha1
+
+
+def _har(time):
+    return UNSET if time is None else time
+
+
+def _packWorkload(transferManager):
+    """ table sizes and packed tables of the transfers of transferManager """
+    transfers = transferManager.transfers
+    index = {t: n for (n, t) in enumerate(transfers)}
+    enabled = set(transferManager.enabledTransfers)
+
+    origins = {}
+    children = array('I')
+    records = []
+    for t in transfers:
+        originIndex = origins.setdefault(t.origin, len(origins))
+        # pages that were not parsed from a .har file have no har times
+        timings = [t.objectTimings[k] for k in TIMINGS] if t.objectTimings else [UNSET] * len(TIMINGS)
+        records.append(RECORD.pack(t.size, _har(t.harStartTime), _har(t.harFinishTime), *timings, originIndex, len(children), len(t.children), t.ssl, t in enabled))
+        children.extend(index[c] for c in t.children)
+
+    originData = [o.encode('utf-8') for o in origins]
+    originOffsets = array('I', [0])
+    for o in originData:
+        originOffsets.append(originOffsets[-1] + len(o))
+    if sys.byteorder == 'big':
+        children.byteswap()
+        originOffsets.byteswap()
+
+    sizes = (len(transfers), len(children), len(originData), originOffsets[-1])
+    return (sizes, b''.join(records) + children.tobytes() + originOffsets.tobytes() + b''.join(originData))
+
+
+def writeWorkload(fh, transferManager, harFileName, verification=False):
+    """ write transfers of transferManager as parsed from harFileName """
+    (sizes, tables) = _packWorkload(transferManager)
+    stat = os.stat(harFileName)
+    fh.write(HEADER.pack(WORKLOAD_MAGIC, WORKLOAD_VERSION, VERIFICATION if verification else 0, _sha1(harFileName),
+                         stat.st_size, stat.st_mtime, *sizes))
+    fh.write(tables)
+
+
+def workloadHash(transferManager):
+    """ sha1 (hex) of the transfers of transferManager - the same whether a page was parsed or loaded """
+    (sizes, tables) = _packWorkload(transferManager)
+    h = hashlib.sha1(struct.pack('<H4I', WORKLOAD_VERSION, *sizes))
+    h.update(tables)
+    return h.hexdigest()
+
+
+def loadWorkload(fileName, transferManager):
+    """ add transfers of a workload file to transferManager - returns the origin of the page """
+    with open(fileName, 'rb') as fh:
+        (_, _, _, _, _, _, transferCount, childCount, originCount, originBytes) = _readHeader(fh)
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = HEADER.size
+            records = RECORD.iter_unpack(mm[offset:offset + transferCount * RECORD.size])
+            offset += transferCount * RECORD.size
+            children = array('I', mm[offset:offset + childCount * 4])
+            offset += childCount * 4
+            originOffsets = array('I', mm[offset:offset + (originCount + 1) * 4])
+            offset += (originCount + 1) * 4
+            originData = mm[offset:offset + originBytes]
+
+    if sys.byteorder == 'big':
+        children.byteswap()
+        originOffsets.byteswap()
+    origins = [originData[originOffsets[n]:originOffsets[n+1]].decode('utf-8') for n in range(originCount)]
+
+    transfers = []
+    links = []
+    for r in records:
+        transfer = Transfer(r[0], origins[r[9]], bool(r[12]), r[1], r[2], dict(zip(TIMINGS, r[3:9])))
+        transfers.append(transfer)
+        links.append((r[10], r[11], r[13]))
+
+    for (transfer, (firstChild, childCount, enabled)) in zip(transfers, links):
+        transfer.children = [transfers[c] for c in children[firstChild:firstChild + childCount]]
+        transferManager.addTransfer(transfer)
+        if enabled:
+            transferManager.enableTransfer(transfer)
+
+    return transfers[0].origin
+
+
+def convert(harFileName, verification=False):
+    """ parse a .har file and write its workload file next to it - returns the name of the workload file """
+    transferManager = TransferManager()
+    with open(harFileName) as fh:
+        HarParser(fh, transferManager, verification).generateTransfers()
+
+    # write to a temporary file first - concurrent readers only ever see complete files
+    fileName = workloadFileName(harFileName, verification)
+    tmpFileName = "{f}.{pid}.tmp".format(f=fileName, pid=os.getpid())
+    with open(tmpFileName, 'wb') as fh:
+        writeWorkload(fh, transferManager, harFileName, verification)
+    os.replace(tmpFileName, fileName)
+    return fileName
+
+
+def readPage(harFileName, transferManager, verification=False):
+    """ add the transfers of a page to transferManager - returns the origin of the page
+
+    uses the workload file if it is up to date or if there is no .har file at all
+    """
+    fileName = workloadFileName(harFileName, verification)
+    if os.path.exists(fileName) and (not os.path.exists(harFileName) or isCurrent(fileName, harFileName, verification)):
+        return loadWorkload(fileName, transferManager)
+
+    with open(harFileName) as fh:
+        h = HarParser(fh, transferManager, verification)
+        h.generateTransfers()
+    return h.origin
+
+
+def findHarFiles(paths):
+    """ .har files given directly or found in directories """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for (directory, _, fileNames) in sorted(os.walk(path)):
+            for fileName in sorted(fileNames):
+                if fileName.endswith(".har"):
+                    yield os.path.join(directory, fileName)
+
+
+def _convertWorker(work):
+    (harFileName, verification) = work
+    try:
+        return (harFileName, convert(harFileName, verification), None)
+    except Exception as e:
+        # one broken capture must not stop the conversion of a whole corpus
+        return (harFileName, None, "{t}: {e}".format(t=type(e).__name__, e=e))
+
+
+def convertAll(harFileNames, verification=False, processes=1, force=False):
+    """ convert .har files that have no current workload file - yields (har file, workload file or None, error) """
+    work = [(h, verification) for h in harFileNames if force or not isCurrent(workloadFileName(h, verification), h, verification)]
+
+    if processes == 1:
+        yield from map(_convertWorker, work)
+        return
+
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with context.Pool(processes) as pool:
+        yield from pool.imap_unordered(_convertWorker, work)
+
+
+if __name__ == "__main__":
+    setupLogging(fast=True)
+
+    parser = argparse.ArgumentParser(description="convert .har files into workload files")
+    parser.add_argument('-j', '--processes', type=int, default=1, help="number of worker processes - 0 uses all cores")
+    parser.add_argument('-f', '--force', action='store_true', help="convert files that have a current workload file, too")
+    parser.add_argument('--verification', action='store_true', help="use sizes like mainVerification.py")
+    parser.add_argument('paths', nargs='+', metavar='har-file-or-directory')
+    args = parser.parse_args()
+
+    failed = 0
+    for (harFileName, fileName, error) in convertAll(findHarFiles(args.paths), args.verification, args.processes or os.cpu_count(), args.force):
+        if error:
+            logger.error("{har}: {error}".format(har=harFileName, error=error))
+            failed += 1
+        else:
+            print(fileName, flush=True)
+
+    sys.exit(1 if failed else 0)
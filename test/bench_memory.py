@@ -0,0 +1,84 @@
+""" Memory benchmark of the objects the simulator creates at high rates
+
+usage: cd test && python3 bench_memory.py
+
+prints the bytes allocated per event, per storage clone and per prediction run.
+not collected by test_runner.sh - run it by hand to compare changes.
+"""
+
+import sys
+import tracemalloc
+import logging
+
+sys.path.insert(0,'../src')
+from simulator.eventSimulator import EventSimulator, NOPREDICT
+from simulator.transferManager import TransferManager
+from simulator.transfer import Transfer
+from simulator.interface import Interface
+from simulator.tcpConnection import TcpConnection
+from simulator.mptcpConnection import MptcpConnection
+from simulator.connection import eventKind
+from simulator.globals import mbit, kb, ms
+
+__author__ = "Mirko Palmer <mirko@inet.tu-berlin.de>, Philipp S. Tiesel <philipp@inet.tu-berlin.de>"
+__copyright__ = "Copyright 2017, FG INET, TU Berlin"
+__license__ = "RELAXED CRAPL v0 BETA 1"
+
+
+logging.disable(logging.WARNING)
+
+COUNT = 10000
+
+
+def allocated(create, count=COUNT):
+    """ bytes allocated per object by count calls of create - the objects are kept alive while measuring """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [create() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the list holding the objects is not part of them
+    return (after - before - sys.getsizeof(objects)) / count
+
+
+def prediction():
+    """ bytes allocated at the peak of one simulated prediction on a page with busy connections """
+    manager = TransferManager()
+    manager.eventSimulator = EventSimulator()
+    manager.interfaces = [Interface(rtt=ms(20), bandwidth=mbit(8), description="if1"),
+                          Interface(rtt=ms(50), bandwidth=mbit(2), description="if2")]
+    manager.useAnalyticPredictions = False
+
+    transfers = [Transfer(size=kb(size), origin="o{n}.com".format(n=n % 4), ssl=n % 2 == 0) for (n, size) in enumerate([300, 80, 500, 20, 120, 1000, 40, 60])]
+    manager.addTransfers(transfers)
+    for t in transfers:
+        manager.enableTransfer(t)
+    for (n, t) in enumerate(transfers[:-1]):
+        manager.scheduleTransfer(t, None, [manager.interfaces[n % 2]] if n % 3 else manager.interfaces, 30.0)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    manager._predictTransfer(transfers[-1], None, manager.interfaces, 30.0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - before
+
+
+if __name__ == "__main__":
+    interface = Interface(rtt=ms(20), bandwidth=mbit(8), description="if1")
+    manager = TransferManager()
+    simulator = EventSimulator()
+    connection = TcpConnection(interface, 30.0, False, "example.com", manager, simulator, NOPREDICT)
+    mptcp = MptcpConnection([interface], 30.0, False, "example.com", manager, simulator, NOPREDICT)
+    transfer = Transfer(size=kb(100), origin="example.com", ssl=False)
+
+    print("{name:<44s}{b:>8s}".format(name="object", b="bytes"))
+    for (name, create) in [("TcpConnection.TransferEvent", lambda: TcpConnection.TransferEvent(connection, 0.1, eventKind.TRANSFER_FINISH, 1, 2)),
+                           ("MptcpConnection.TransferEvent", lambda: MptcpConnection.TransferEvent(mptcp, 0.1, eventKind.TRANSFER_FINISH, 1, 2)),
+                           ("Transfer.TransferStorage.clone()", transfer.rStorage.clone),
+                           ("TcpConnection.ConnectionStorage.clone()", connection.rStorage.clone),
+                           ("MptcpConnection.ConnectionStorage.clone()", mptcp.rStorage.clone),
+                           ("Interface.InterfaceStorage.clone()", interface.rStorage.clone)]:
+        print("{name:<44s}{b:>8.0f}".format(name=name, b=allocated(create)))
+
+    print("{name:<44s}{b:>8d}".format(name="prediction (peak)", b=prediction()))